@@ -0,0 +1,470 @@
+from __future__ import print_function  # needed to print without newline, imported from Python 3.x
+import sys
+import os
+import csv
+import json
+import random
+import shutil
+import tempfile
+import timeit
+from array import array
+
+import data_parsing_gallup as gallup
+import check_rounds
+import output_files
+import round_features
+
+try:
+    import event_cache  # needs numpy
+except ImportError:
+    event_cache = None
+
+try:
+    import similarity  # needs numpy
+except ImportError:
+    similarity = None
+
+try:
+    import risk  # needs numpy
+    import numpy as np
+except ImportError:
+    risk = None
+
+STATE_COUNTS = [10, 100, 1000, 2000]  # number of distinct states the graph is filled with
+EVENTS_PER_STATE = 10  # how many times each state is looked up by add_event_string_based
+LOG_ROUNDS = [10, 100, 1000, 10000]  # number of rounds of the synthetic logs
+GAME_ROUNDS = [10, 100, 1000]  # number of rounds of the synthetic games whose trajectory keys are built
+TRAJECTORY_COUNTS = [100, 200, 400]  # number of synthetic trajectories whose similarities are computed
+TRAJECTORY_LENGTH = 40  # number of states of the synthetic trajectories (before edits)
+TRAJECTORY_STATES = 200  # number of distinct states of the synthetic trajectories
+TRAJECTORY_CLUSTERS = 20  # number of base trajectories the synthetic trajectories are edited from
+TRAJECTORY_EDITS = 4  # greatest number of random edits applied to a base trajectory
+GRAPH_TEAMS = [10, 100, 500]  # number of synthetic teams parsed onto the graphs that are serialized
+GRAPH_ROUNDS = 20  # number of rounds of the games of the synthetic teams
+GRAPH_EVENTS = {"round", "risk", "risk_proneness", "voting_st_dev", "round+risk"}  # events the graphs are built from
+DECISION_COUNTS = [1000, 10000, 100000]  # number of synthetic decisions whose risk is classified
+DISPATCH_EVENTS = [set(), {"round+risk"}, GRAPH_EVENTS]  # events to process whose handler tables are compared
+MINING_TOOLS = [("Pickaxe", "0.9"), ("Shovel", "0.8"), ("Drill", "0.6"), ("Dynamite", "0.3"), ("Laser", "0.2")]
+MINES = [("GoldMine", "(0.1 0.5)"), ("SilverMine", "(0.4 0.9)")]
+
+
+def write_synthetic_log(path, rounds, players=3, seed=0):
+    """
+    write a synthetic team log with the same events and columns as the raw data files
+    :param path: path of the csv file to write
+    :param rounds: number of rounds of the game
+    :param players: number of players of the team
+    :param seed: seed of the random generator
+    :return:
+    """
+    rng = random.Random(seed)
+    names = ["player" + str(i) for i in range(players)]
+    items = [name for name, prob in MINING_TOOLS] + [name for name, prob in MINES]
+    gold = 0
+    with open(path, 'wb') as data_file:
+        writer = csv.writer(data_file)
+        for name in names:
+            writer.writerow(["PlayerConnection", "0", name])
+        writer.writerow(["SetupMatch", "0", "", "", "", str(rng.randint(0, 2))])
+        for name, prob in MINING_TOOLS:
+            writer.writerow(["ItemSetup", "0", name, "", prob])
+        for name, prob in MINES:
+            writer.writerow(["MineSetup", "0", name, "", prob])
+        for round_number in range(rounds):
+            writer.writerow(["GoldSetup", "0"])
+            for selection in range(rng.randint(1, 3)):
+                item1, item2 = rng.sample(items, 2)
+                writer.writerow(["StartVotation", "0", item1, item2])
+                for name in names:
+                    writer.writerow(["Vote", "0", name, rng.choice([item1, item2])])
+                selected = rng.choice([item1, item2])
+                writer.writerow(["LeaderSelection", "0", selected])
+                writer.writerow(["UseItem", "0", selected])
+                for name in names:
+                    writer.writerow(["ArrivedTo", "0", name, "(" + str(rng.randint(0, 59)) + " " +
+                                     str(rng.randint(0, 59)) + ")"])
+                    if rng.random() < 0.5:
+                        found = rng.randint(0, 100)
+                        gold = gold + found
+                        writer.writerow(["FoundGold", "0", name, "", str(found)])
+                    if rng.random() < 0.3:
+                        writer.writerow(["ChatMessage", "0", name, "hello"])
+                writer.writerow(["TotalGold", "0", str(gold)])
+
+
+def find_state_by_scan(graph, event):
+    """
+    linear lookup of a state by label, as done by Graph.add_event_string_based before the index was added
+    :param graph: the graph to search
+    :param event: the label to look up
+    :return: the id of the state, or -1 if the state does not exist
+    """
+    for key_iterator, value in graph.states.items():
+        if value['details']['event_type'] == event:
+            return key_iterator
+    return -1
+
+
+def benchmark_state_lookup():
+    """
+    shows how the cost of Graph.add_event_string_based scales with the number of states,
+    comparing the label index with the former linear scan
+    :return:
+    """
+    print("states\tevents\tindex (s)\tscan (s)")
+    for state_count in STATE_COUNTS:
+        labels = ["round+risk" + str(i) + ": ['high']" for i in range(state_count)]
+        events = labels * EVENTS_PER_STATE
+
+        graph = gallup.Graph()
+
+        def add_events():
+            trajectory = [0]
+            for event in events:
+                graph.add_event_string_based(event, "round", "team", trajectory, None)
+
+        def scan_events():
+            for event in events:
+                find_state_by_scan(graph, event)
+
+        index_time = timeit.timeit(add_events, number=1)
+        scan_time = timeit.timeit(scan_events, number=1)
+        print(str(state_count) + "\t" + str(len(events)) + "\t" + "%.4f" % index_time + "\t" + "%.4f" % scan_time)
+
+
+def benchmark_event_cache():
+    """
+    compares parsing a raw log with the csv reader against reloading its memory mapped event cache
+    :return:
+    """
+    if event_cache is None:
+        print("skipped: the event cache needs numpy")
+        return
+
+    folder = tempfile.mkdtemp()
+    try:
+        print("rows\tcsv (s)\tbuild (s)\tmmap count (s)\tmmap rows (s)")
+        for rounds in LOG_ROUNDS:
+            csv_path = os.path.join(folder, "log_" + str(rounds) + ".csv")
+            cache_path = os.path.join(folder, "cache_" + str(rounds))
+            write_synthetic_log(csv_path, rounds)
+
+            def parse_csv():
+                with open(csv_path, 'rU') as data_file:
+                    return sum(1 for row in csv.reader(data_file) if row[0] == gallup.ROUND_SEPARATOR)
+
+            def reload_and_count():
+                return event_cache.EventCache(cache_path).count(gallup.ROUND_SEPARATOR)
+
+            def reload_rows():
+                return sum(1 for row in event_cache.EventCache(cache_path).rows())
+
+            build_time = timeit.timeit(lambda: event_cache.build_event_cache(csv_path, cache_path), number=1)
+            csv_time = min(timeit.repeat(parse_csv, number=1, repeat=3))
+            count_time = min(timeit.repeat(reload_and_count, number=1, repeat=3))
+            rows_time = min(timeit.repeat(reload_rows, number=1, repeat=3))
+            rows = len(event_cache.EventCache(cache_path))
+            print(str(rows) + "\t" + "%.4f" % csv_time + "\t" + "%.4f" % build_time + "\t" +
+                  "%.4f" % count_time + "\t" + "%.4f" % rows_time)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_trajectory_keys():
+    """
+    compares building the trajectory key of a game as a string of event names, extended event by event as done by the
+    team parsers before the keys were hashed, with taking the bytes of its sequence of event codes, which the parsers
+    build anyway for the action meaning
+    :return:
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        print("rounds\tevents\tstring (s)\tcodes (s)\tstring (bytes)\tcodes (bytes)")
+        for rounds in GAME_ROUNDS:
+            csv_path = os.path.join(folder, "game_" + str(rounds) + ".csv")
+            write_synthetic_log(csv_path, rounds)
+            with open(csv_path, 'rU') as data_file:
+                events = [row[0] for row in csv.reader(data_file)]
+            event_sequence = array('H', [gallup.START_GAME_CODE] + [gallup.event_code(event) for event in events])
+
+            def string_key():
+                key = ""
+                for event in events:
+                    key += ('_' + event)
+                return key
+
+            def code_key():
+                return event_sequence.tostring()
+
+            string_time = min(timeit.repeat(string_key, number=1, repeat=3))
+            code_time = min(timeit.repeat(code_key, number=1, repeat=3))
+            print(str(rounds) + "\t" + str(len(events)) + "\t" + "%.4f" % string_time + "\t" + "%.4f" % code_time +
+                  "\t" + str(sys.getsizeof(string_key())) + "\t" + str(sys.getsizeof(code_key())))
+    finally:
+        shutil.rmtree(folder)
+
+
+def synthetic_trajectories(count, seed=0):
+    """
+    generate state sequences as random edits of a few base sequences, so that each has close neighbours
+    :param count: number of sequences
+    :param seed: seed of the random generator
+    :return: list of the state sequences
+    """
+    rng = random.Random(seed)
+    bases = [[rng.randrange(2, TRAJECTORY_STATES) for i in range(TRAJECTORY_LENGTH)]
+             for cluster in range(TRAJECTORY_CLUSTERS)]
+    sequences = []
+    for i in range(count):
+        sequence = list(rng.choice(bases))
+        for edit in range(rng.randint(0, TRAJECTORY_EDITS)):
+            position = rng.randrange(len(sequence))
+            operation = rng.randrange(3)
+            if operation == 0:
+                sequence[position] = rng.randrange(2, TRAJECTORY_STATES)
+            elif operation == 1:
+                sequence.insert(position, rng.randrange(2, TRAJECTORY_STATES))
+            else:
+                del sequence[position]
+        sequences.append([0] + sequence + [1])
+    return sequences
+
+
+def benchmark_similarity():
+    """
+    compares the exact nearest neighbours by edit distance with the minhash lsh approximation: recall is the fraction
+    of the exact neighbour pairs found by the approximation
+    :return:
+    """
+    if similarity is None:
+        print("skipped: the similarities need numpy")
+        return
+
+    print("trajectories\texact (s)\tminhash (s)\texact pairs\tminhash pairs\trecall")
+    for count in TRAJECTORY_COUNTS:
+        sequences = synthetic_trajectories(count)
+        results = {}
+
+        def exact():
+            results['exact'] = similarity.edit_similarities(sequences)
+
+        def approximate():
+            results['minhash'] = similarity.minhash_similarities(sequences)
+
+        exact_time = timeit.timeit(exact, number=1)
+        minhash_time = timeit.timeit(approximate, number=1)
+        exact_pairs = set((pair['source'], pair['target']) for pair in results['exact'])
+        minhash_pairs = set((pair['source'], pair['target']) for pair in results['minhash'])
+        recall = float(len(exact_pairs & minhash_pairs)) / max(len(exact_pairs), 1)
+        print(str(count) + "\t" + "%.4f" % exact_time + "\t" + "%.4f" % minhash_time + "\t" +
+              str(len(exact_pairs)) + "\t" + str(len(minhash_pairs)) + "\t" + "%.3f" % recall)
+
+
+def synthetic_graph(folder, teams):
+    """
+    parse synthetic team logs onto the graph of a single experimental condition
+    :param folder: folder where the logs are written
+    :param teams: number of teams
+    :return: the graph
+    """
+    graph = gallup.Graph()
+    for team in range(teams):
+        filename = "team_" + str(team) + ".csv"
+        write_synthetic_log(os.path.join(folder, filename), GRAPH_ROUNDS, seed=team)
+        graph.merge(gallup.parse_team_file(folder + os.sep, filename, {'events_to_process': GRAPH_EVENTS}))
+    graph.target_count = teams
+    return graph
+
+
+def benchmark_serializers():
+    """
+    compares the encoding time and the output size of the serializers on the visualization of synthetic graphs
+    :return:
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        print("teams\tserializer\ttime (s)\tsize (bytes)")
+        for teams in GRAPH_TEAMS:
+            graph = synthetic_graph(folder, teams)
+            for name in sorted(output_files.SERIALIZERS.keys()):
+                serializer = output_files.get_serializer(name)
+                path = os.path.join(folder, "output" + serializer.extension)
+
+                def write():
+                    output_files.write_document(path, gallup.visualization_document(graph), serializer)
+
+                write_time = min(timeit.repeat(write, number=1, repeat=3))
+                print(str(teams) + "\t" + serializer.name + "\t" + "%.4f" % write_time + "\t" +
+                      str(os.path.getsize(path)))
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_round_count():
+    """
+    compares counting the rounds of a raw log with the csv reader and with the byte search on the memory mapped file
+    :return:
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        print("rounds\tcsv (s)\tmmap (s)")
+        for rounds in LOG_ROUNDS:
+            csv_path = os.path.join(folder, "log_" + str(rounds) + ".csv")
+            write_synthetic_log(csv_path, rounds)
+            assert check_rounds.count_rounds_csv(csv_path) == check_rounds.count_rounds_mmap(csv_path) == rounds
+
+            csv_time = min(timeit.repeat(lambda: check_rounds.count_rounds_csv(csv_path), number=1, repeat=3))
+            mmap_time = min(timeit.repeat(lambda: check_rounds.count_rounds_mmap(csv_path), number=1, repeat=3))
+            print(str(rounds) + "\t" + "%.4f" % csv_time + "\t" + "%.4f" % mmap_time)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_event_dispatch():
+    """
+    measures parsing the rows of a team with the handler tables of a few sets of events to process: the rows of the
+    events no analysis needs only cost the lookup of their (empty) handlers
+    :return:
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        print("rounds\tevents to process\thandlers\ttime (s)")
+        for rounds in GAME_ROUNDS:
+            csv_path = os.path.join(folder, "game_" + str(rounds) + ".csv")
+            write_synthetic_log(csv_path, rounds)
+            with open(csv_path, 'rU') as data_file:
+                rows = list(csv.reader(data_file))
+
+            for events in DISPATCH_EVENTS:
+                settings = {'events_to_process': events}
+                handlers = gallup.event_handlers(gallup.ProcessingContext(settings=settings), per_condition=True)
+
+                def parse():
+                    gallup.parse_team_graph(gallup.ProcessingContext(settings=settings), rows, "game.csv")
+
+                parse_time = min(timeit.repeat(parse, number=1, repeat=3))
+                print(str(rounds) + "\t" + (",".join(sorted(events)) or "-") + "\t" +
+                      str(sum(len(code_handlers) for code_handlers in handlers.values())) + "\t" + "%.4f" % parse_time)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_session_feed():
+    """
+    compares feeding the rows of a cached team log to a TeamSessionMachine one by one, decoded into lists of strings,
+    with feeding them in batch from the cached codes
+    :return:
+    """
+    if event_cache is None:
+        print("skipped: the event cache needs numpy")
+        return
+
+    folder = tempfile.mkdtemp()
+    try:
+        settings = {'events_to_process': {"round+risk"}}
+        print("rows\tone by one (s)\tbatch (s)")
+        for rounds in LOG_ROUNDS:
+            csv_path = os.path.join(folder, "log_" + str(rounds) + ".csv")
+            write_synthetic_log(csv_path, rounds)
+            rows = event_cache.CachedRows(event_cache.load_event_cache(csv_path, os.path.join(folder, "cache")))
+
+            def feed(batch):
+                machine = gallup.TeamSessionMachine(gallup.ProcessingContext(settings=settings), "log.csv",
+                                                    gallup.Graph(), True)
+                if batch:
+                    machine.feed_cached(rows)
+                else:
+                    for row in rows:
+                        machine.feed(row)
+                return machine.close()
+
+            one_time = min(timeit.repeat(lambda: feed(False), number=1, repeat=3))
+            batch_time = min(timeit.repeat(lambda: feed(True), number=1, repeat=3))
+            print(str(len(rows)) + "\t" + "%.4f" % one_time + "\t" + "%.4f" % batch_time)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_round_features():
+    """
+    compares re-deriving the risks of each team and round from the round+risk labels of the visualization json with
+    extracting the team x round feature table from the raw logs in a single pass
+    :return:
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        print("teams\tgraph and json (s)\tfeature table (s)")
+        for teams in GRAPH_TEAMS:
+            logs = os.path.join(folder, "logs_" + str(teams)) + os.sep
+            os.mkdir(logs)
+            for team in range(teams):
+                write_synthetic_log(os.path.join(logs, "team_" + str(team) + ".csv"), GRAPH_ROUNDS, seed=team)
+            path = os.path.join(folder, "output.json")
+
+            def from_json():
+                graph = gallup.Graph()
+                for filename in os.listdir(logs):
+                    graph.merge(gallup.parse_team_file(logs, filename, {'events_to_process': GRAPH_EVENTS}))
+                output_files.write_document(path, gallup.visualization_document(graph))
+                with open(path) as json_file:
+                    return [node["details"]["event_type"] for node in json.load(json_file)["nodes"]
+                            if node["details"]["event_type"].startswith("round+risk")]
+
+            json_time = min(timeit.repeat(from_json, number=1, repeat=3))
+            table_time = min(timeit.repeat(lambda: round_features.extract_round_features(logs), number=1, repeat=3))
+            print(str(teams) + "\t" + "%.4f" % json_time + "\t" + "%.4f" % table_time)
+    finally:
+        shutil.rmtree(folder)
+
+
+def benchmark_risk_classification():
+    """
+    compares classifying the risk of synthetic decisions one by one with classifying them all at once
+    :return:
+    """
+    if risk is None:
+        print("skipped: the batch risk classification needs numpy")
+        return
+
+    random_state = np.random.RandomState(0)
+    probabilities = np.array([float(prob) for name, prob in MINING_TOOLS] + [0.1, 0.4])
+    thresholds = (gallup.RISK_DIFFERENCE_NEGLIGIBLE, gallup.PRONENESS_DIFFERENCE_LOW, gallup.PRONENESS_DIFFERENCE_HIGH)
+    print("decisions\tone by one (s)\tbatch (s)")
+    for count in DECISION_COUNTS:
+        item1_probs = probabilities[random_state.randint(len(probabilities), size=count)]
+        item2_probs = probabilities[random_state.randint(len(probabilities), size=count)]
+        selected_first = random_state.rand(count) < 0.5
+
+        def one_by_one():
+            return [gallup.classify_risk(item1_prob, item2_prob, first) for item1_prob, item2_prob, first
+                    in zip(item1_probs.tolist(), item2_probs.tolist(), selected_first.tolist())]
+
+        def batch():
+            return risk.classify_risks(item1_probs, item2_probs, selected_first, *thresholds)
+
+        risks, proneness = batch()
+        assert one_by_one() == zip(risks.tolist(), proneness.tolist())
+        one_time = min(timeit.repeat(one_by_one, number=1, repeat=3))
+        batch_time = min(timeit.repeat(batch, number=1, repeat=3))
+        print(str(count) + "\t" + "%.4f" % one_time + "\t" + "%.4f" % batch_time)
+
+
+BENCHMARKS = {
+    "state_lookup": benchmark_state_lookup,
+    "event_cache": benchmark_event_cache,
+    "trajectory_keys": benchmark_trajectory_keys,
+    "similarity": benchmark_similarity,
+    "serializers": benchmark_serializers,
+    "round_count": benchmark_round_count,
+    "event_dispatch": benchmark_event_dispatch,
+    "session_feed": benchmark_session_feed,
+    "risk_classification": benchmark_risk_classification,
+    "round_features": benchmark_round_features
+}
+
+if __name__ == "__main__":
+    # run the benchmarks named on the command line, or all of them
+    names = sys.argv[1:] if len(sys.argv) > 1 else sorted(BENCHMARKS.keys())
+    for name in names:
+        print("--- " + name)
+        BENCHMARKS[name]()
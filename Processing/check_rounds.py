@@ -1,30 +1,366 @@
 import json
 import csv
 import os
+import re
+import mmap
+import argparse
+import multiprocessing
 
 EVENT_COLUMN = 0  # column containing the events (including player actions)
 ROUND_SEPARATOR = "GoldSetup"  # when a new round starts
+EVENT_CACHE_FOLDER = "../data/event_cache/"  # folder containing the columnar event caches of the files
+ROUNDS_INDEX_FILE = "rounds_index.json"  # size, mtime, rounds and marker offsets of the checked files (see MARKERS)
+QUOTE = b'"'  # files containing quotes are parsed with the csv reader, since a quoted cell can span lines
+LINE_ENDS = b"\r\n"  # characters ending a line (any of the newlines accepted by the csv reader in 'rU' mode)
+CELL_ENDS = b",\r\n"  # characters ending the first cell of a row
+LINE_END = re.compile(b"\r\n|\r|\n")  # newlines ending the lines read by LineOffsets (as in 'rU' mode)
+LINE_CHUNK = 1 << 16  # bytes of a file read at once by LineOffsets
+# events whose rows are indexed by byte offset and row number: the rounds, the setup of the match,
+# and the points where a game is truncated
+MARKERS = [ROUND_SEPARATOR, "SetupMatch", "GameSuspended", "END"]
+FILE_SEPARATOR = ".csv"  # in the concatenated files, each team starts with a row whose first cell is its file name
+TEAM_MARKER = "team"  # key of the rows starting a team in the markers
 
-if __name__ == "__main__":
-    input_folder = "../data/files_to_check/"
-    output_file = "../data/rounds/rounds.csv"
+
+def count_rounds_csv(path):
+    """
+    count the rounds of a file parsing it with the csv reader
+    :param path: path of the file
+    :return: number of rounds
+    """
+    with open(path, 'rU') as data_file:
+        csv_reader = csv.reader(data_file)
+        round_counter = 0
+        for row in csv_reader:
+            if row[EVENT_COLUMN] == ROUND_SEPARATOR:
+                round_counter = round_counter + 1
+    return round_counter
+
+
+def find_first_cells(mapped_file, cell):
+    """
+    find the rows whose first cell is the given one, searching the cell at the start of the lines of the file
+    :param mapped_file: the memory mapped file (or any string)
+    :param cell: the content of the cell
+    :return: generator of the byte offsets of the rows
+    """
+    position = mapped_file.find(cell)
+    while position > -1:
+        end = position + len(cell)
+        if ((position == 0 or mapped_file[position - 1] in LINE_ENDS) and
+                (end == len(mapped_file) or mapped_file[end] in CELL_ENDS)):
+            yield position
+        position = mapped_file.find(cell, end)
+
+
+def find_team_rows(mapped_file):
+    """
+    find the rows starting a team in a concatenated file: the rows whose first cell contains FILE_SEPARATOR
+    :param mapped_file: the memory mapped file (or any string)
+    :return: generator of the byte offsets of the rows
+    """
+    previous = -1
+    position = mapped_file.find(FILE_SEPARATOR)
+    while position > -1:
+        line_start = max(mapped_file.rfind(b"\n", 0, position), mapped_file.rfind(b"\r", 0, position)) + 1
+        if line_start != previous and mapped_file.find(b",", line_start, position) == -1:
+            previous = line_start
+            yield line_start
+        position = mapped_file.find(FILE_SEPARATOR, position + len(FILE_SEPARATOR))
+
+
+def count_line_ends(text):
+    """
+    :param text: a string made of whole lines
+    :return: number of line ends (\n, \r\n or \r) in the string
+    """
+    return text.count(b"\n") + text.count(b"\r") - text.count(b"\r\n")
+
+
+def scan_markers_mmap(mapped_file):
+    """
+    find the rows of the markers searching them at the start of the lines of a memory mapped file without quotes
+    :param mapped_file: the memory mapped file
+    :return: dictionary of the [byte offset, row number] pairs of the rows of each marker
+    """
+    found = []
+    for marker in MARKERS:
+        found.extend((offset, marker) for offset in find_first_cells(mapped_file, marker))
+    found.extend((offset, TEAM_MARKER) for offset in find_team_rows(mapped_file))
+    found.sort()
+
+    markers = dict((marker, []) for marker in MARKERS + [TEAM_MARKER])
+    row = 0
+    previous = 0
+    for offset, marker in found:
+        row += count_line_ends(mapped_file[previous:offset])
+        previous = offset
+        markers[marker].append([offset, row])
+    return markers
+
+
+class LineOffsets:
+    """
+    iterator over the lines of a file opened in binary mode keeping the byte offset of the next line, to be read by
+    the csv reader; as in 'rU' mode, lines end with any of \n, \r\n or \r (see LINE_ENDS), which is returned as \n,
+    so files whose lines end with \r only are read as by the parsers
+    """
+    def __init__(self, data_file):
+        self.file = data_file
+        self.offset = 0
+        self.buffer = b""
+        self.position = 0  # position of the next line in the buffer
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        newline, end = self.line_end()
+        start = self.position
+        if end == start:
+            raise StopIteration
+        self.offset += end - start
+        self.position = end
+        if newline == end:
+            return self.buffer[start:end]
+        return self.buffer[start:newline] + b"\n"
+
+    def line_end(self):
+        """
+        read more of the file into the buffer until the next line is complete
+        :return: positions in the buffer of the newline ending the next line and of the end of the line (after its
+        newline), which are the same if the file ends without a newline
+        """
+        search = self.position
+        while True:
+            match = LINE_END.search(self.buffer, search)
+            # a \r ending the buffer may be the first half of a \r\n
+            if match is not None and not (match.group() == b"\r" and match.end() == len(self.buffer)):
+                return match.start(), match.end()
+            chunk = self.file.read(LINE_CHUNK)
+            if not chunk:
+                return len(self.buffer), len(self.buffer)
+            search = (match.start() if match is not None else len(self.buffer)) - self.position
+            self.buffer = self.buffer[self.position:] + chunk
+            self.position = 0
+
+
+def scan_markers_csv(path):
+    """
+    find the rows of the markers parsing a file with the csv reader
+    :param path: path of the file
+    :return: dictionary of the [byte offset, row number] pairs of the rows of each marker
+    """
+    markers = dict((marker, []) for marker in MARKERS + [TEAM_MARKER])
+    with open(path, 'rb') as data_file:
+        lines = LineOffsets(data_file)
+        csv_reader = csv.reader(lines)
+        row_number = 0
+        offset = lines.offset
+        for row in csv_reader:
+            if row and row[EVENT_COLUMN] in markers:
+                markers[row[EVENT_COLUMN]].append([offset, row_number])
+            elif row and row[EVENT_COLUMN].find(FILE_SEPARATOR) > -1:
+                markers[TEAM_MARKER].append([offset, row_number])
+            row_number += 1
+            offset = lines.offset
+    return markers
+
+
+def scan_markers(path):
+    """
+    find the byte offset and the row number of the rows of the markers (and of the rows starting a team, indexed by
+    TEAM_MARKER) of a file, searching them in the memory mapped
+    file, or parsing it with the csv reader if it contains quotes
+    :param path: path of the file
+    :return: dictionary of the [byte offset, row number] pairs of the rows of each marker
+    """
+    if os.path.getsize(path) == 0:
+        return dict((marker, []) for marker in MARKERS + [TEAM_MARKER])
+    with open(path, 'rb') as data_file:
+        mapped_file = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mapped_file.find(QUOTE) > -1:
+                return scan_markers_csv(path)
+            return scan_markers_mmap(mapped_file)
+        finally:
+            mapped_file.close()
+
+
+def count_rounds_mmap(path):
+    """
+    count the rounds of a file searching the round separator at the start of the lines of the memory mapped file;
+    falls back to the csv reader if the file contains quotes
+    :param path: path of the file
+    :return: number of rounds
+    """
+    if os.path.getsize(path) == 0:
+        return 0
+    with open(path, 'rb') as data_file:
+        mapped_file = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mapped_file.find(QUOTE) > -1:
+                return count_rounds_csv(path)
+            return sum(1 for offset in find_first_cells(mapped_file, ROUND_SEPARATOR))
+        finally:
+            mapped_file.close()
+
+
+def index_file(arguments):
+    """
+    count the rounds of a file and, unless its columnar event cache is used, index its markers;
+    used by the worker processes
+    :param arguments: path of the file, and whether its columnar event cache is used
+    :return: entry of the file in the index
+    """
+    path, use_event_cache = arguments
+    if use_event_cache:
+        import event_cache  # needs numpy, which is only required when the event cache is used
+        return {'round': event_cache.load_event_cache(path, EVENT_CACHE_FOLDER).count(ROUND_SEPARATOR)}
+    markers = scan_markers(path)
+    return {'round': len(markers[ROUND_SEPARATOR]), 'markers': markers}
+
+
+def file_signature(path):
+    """
+    :param path: path of a file
+    :return: size and mtime of the file, which change when the file changes
+    """
+    file_stat = os.stat(path)
+    return {'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+
+def is_up_to_date(entry, signature, needs_markers=True):
+    """
+    :param entry: entry of a file in the index, or None
+    :param signature: current size and mtime of the file
+    :param needs_markers: if True, an entry without markers (counted on the event cache) is not up to date
+    :return: True if the entry describes the current version of the file
+    """
+    return (entry is not None and entry['size'] == signature['size'] and entry['mtime'] == signature['mtime'] and
+            (not needs_markers or ('markers' in entry and TEAM_MARKER in entry['markers'])))
+
+
+def load_rounds_index(folder):
+    """
+    :param folder: folder of rounds.csv
+    :return: the index of the checked files, empty if it does not exist
+    """
+    index_path = os.path.join(folder, ROUNDS_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as index_input_file:
+        return json.load(index_input_file)
+
+
+def file_markers(path, index=None):
+    """
+    get the markers of a file from the index if it is up to date, scanning the file otherwise
+    :param path: path of the file
+    :param index: index of the checked files (see load_rounds_index), indexed by file name
+    :return: dictionary of the [byte offset, row number] pairs of the rows of each marker
+    """
+    entry = (index or {}).get(os.path.basename(path))
+    if is_up_to_date(entry, file_signature(path)):
+        return entry['markers']
+    return scan_markers(path)
+
+
+def truncation_point(markers):
+    """
+    :param markers: the markers of a file
+    :return: [byte offset, row number] of the first row where the game is suspended or ended, or None
+    """
+    points = markers["GameSuspended"] + markers["END"]
+    return min(points) if points else None
+
+
+def read_rows_at(path, offset, stop=None):
+    """
+    read the rows of a file from a byte offset, for instance the offset of a round taken from its markers
+    :param path: path of the file
+    :param offset: byte offset of the first row to read
+    :param stop: byte offset where reading stops (default: the end of the file)
+    :return: generator of the rows, as returned by the csv reader
+    """
+    with open(path, 'rb') as data_file:
+        data_file.seek(offset)
+        lines = LineOffsets(data_file)
+        lines.offset = offset
+        csv_reader = csv.reader(lines)
+        while stop is None or lines.offset < stop:
+            try:
+                row = next(csv_reader)
+            except StopIteration:
+                return
+            yield row
+
+
+def check_rounds(input_folder, output_file, workers=1, use_event_cache=False):
+    """
+    write the number of rounds of each file of the input folder to the output csv file, and the index of the markers
+    of each file next to it; only the files that are new or changed since the last check are scanned,
+    the others keep their previous entry
+    :param input_folder: folder of the files to check
+    :param output_file: csv file with the number of rounds of each file
+    :param workers: number of processes scanning the files
+    :param use_event_cache: if True, the rounds are counted on the columnar event caches of the files
+    (which do not keep the byte offsets, so the markers are not indexed)
+    :return:
+    """
+    output_folder = os.path.dirname(output_file)
+    previous = load_rounds_index(output_folder) if os.path.exists(output_file) else {}
+
+    filenames = []
+    for subdir, dirs, files in os.walk(input_folder):
+        for filename in files:
+            filenames.append(filename)
+
+    index = {}
+    to_scan = []
+    for filename in filenames:
+        signature = file_signature(input_folder + filename)
+        if is_up_to_date(previous.get(filename), signature, not use_event_cache):
+            index[filename] = previous[filename]
+        else:
+            print("searching rounds in file: " + filename)
+            index[filename] = signature
+            to_scan.append(filename)
+
+    arguments = [(input_folder + filename, use_event_cache) for filename in to_scan]
+    if workers > 1 and len(to_scan) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            entries = pool.map(index_file, arguments)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        entries = [index_file(argument) for argument in arguments]
+    for filename, entry in zip(to_scan, entries):
+        index[filename].update(entry)
 
     with open(output_file, 'wb') as csv_output_file:
         writer = csv.writer(csv_output_file)
         writer.writerow(["filename", "round"])
+        for filename in filenames:
+            writer.writerow([filename, index[filename]['round']])
+
+    # the index is written after rounds.csv, so that it never describes counts that have not been written
+    with open(os.path.join(output_folder, ROUNDS_INDEX_FILE), 'w') as index_output_file:
+        json.dump(index, index_output_file)
 
-        for subdir, dirs, files in os.walk(input_folder):
-            for filename in files:
-                print("searching rounds in file: " + filename)
-                with open(input_folder + filename, 'rU') as data_file:
-                    csv_reader = csv.reader(data_file)
-                    round_counter = 0
-                    for row in csv_reader:
-                        if row[EVENT_COLUMN] == ROUND_SEPARATOR:
-                            round_counter = round_counter + 1
 
-                    output_row = [filename, round_counter]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="count the rounds of the files to check")
+    parser.add_argument("--event-cache", action="store_true",
+                        help="count the rounds on the columnar event caches in " + EVENT_CACHE_FOLDER +
+                             ", building them the first time")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes scanning the files (default: 1)")
+    args = parser.parse_args()
 
-                    writer.writerow(output_row)
+    input_folder = "../data/files_to_check/"
+    output_file = "../data/rounds/rounds.csv"
 
-        csv_output_file.close()
+    check_rounds(input_folder, output_file, args.workers, args.event_cache)
@@ -2,16 +2,39 @@ from __future__ import print_function  # needed to print without newline, import
 import json
 import csv
 import os
-import statistics
+import math
+import argparse
+import multiprocessing
+import hashlib
+import pickle
+import threading
+from array import array
+
+try:
+    import event_cache  # needs numpy, which is only required when the event cache is used
+except ImportError:
+    event_cache = None
+
+import output_files
+import check_rounds
+
+try:
+    import similarity  # needs numpy, which is only required when the similarities among trajectories are computed
+except ImportError:
+    similarity = None
+
+try:
+    import risk  # needs numpy, which is only required to classify the risks of the cached sessions in batch
+except ImportError:
+    risk = None
 
-SINGLE_GRAPH = None  # single global graph that has to be initialized in the main function (cannot be initialized here)
 FOCUS = "teams"  # can be "single_players" or "teams"
 FILE_SEPARATOR = ".csv"  # input files must have the .csv extension, otherwise the csv reader does not work
 EVENTS_TO_PROCESS = {"round+risk"}  # events that can be processed:
 # "gold", "round", "distance", "risk", "voting_st_dev", "risk_aversion", "round+risk", "risk_proneness"
 SIMPLE_STATE_CRITERION = True  # used to determine which add_event function to use
-GRAPHS = {}  # dictionary of graphs indexed by experimental conditions
-VISUALIZATIONS = {}  # dictionary of visualizations based on GRAPHS
+# events derived from the rows of the teams, added as string based states (see compile_handlers)
+DERIVED_EVENTS = {"voting_st_dev", "risk", "risk_proneness", "risk_aversion", "round", "round+risk"}
 COMPETITION_LEVEL_COLUMN = 5  # column containing the leader selection algorithm
 CHOSEN_FILENAME = ""  # write a string to override the output file name equal to the source file name
 EVENT_COLUMN = 0  # column containing the events (including player actions)
@@ -32,10 +55,24 @@ GOLD_INCREASE = 100  # when a new state based on the amount of TotalGold has to
 DISTANCE_INCREASE = 100  # when a new state based on the distance traversed has to be created
 RISK_THRESHOLD_LOW = 0.50  # used to select the set a selected item belongs to
 RISK_THRESHOLD_MEDIUM = 0.70  # used to select the set a selected item belongs to
-PROCESS_CURRENT_TEAM = True  # used to skip the rest of a team file containing "GameSuspended"
-
-MINING_TOOLS = {}  # dictionary of mining tools available to the team, with their probability of success
-MINES = {}  # dictionary of mines available to the team, with their min and max probability of success
+RISK_DIFFERENCE_NEGLIGIBLE = 0.1001  # differences between the success probs. of the items to choose up to this are negligible
+PRONENESS_DIFFERENCE_LOW = 0.3001  # high risks taken on differences up to this show a low risk proneness
+PRONENESS_DIFFERENCE_HIGH = 0.6001  # high risks taken on differences from this show a high risk proneness
+ST_DEV_DECIMALS = 10  # decimals of the st_dev of the votes compared with the bounds of its bins
+CACHE_FOLDER = "../data/cache/"  # folder of the manifest of the raw data files and of their cached partial graphs
+MANIFEST_FILE = "manifest.json"  # manifest of the raw data files whose partial graphs are cached
+CACHE_FORMAT = 2  # version of the format of the cached partial graphs (see partial_graph_data)
+EVENT_CACHE_FOLDER = None  # if set, raw data files are read from their columnar event caches in this folder
+SIMILARITY_METRIC = None  # metric of the similarities among trajectories: "counts", "edit", "minhash" or None
+SIMILARITY_WORKERS = 1  # number of processes computing the edit distances among trajectories
+COMPRESS_OUTPUT = False  # if True, the files for glyph are written compressed with gzip (.gz)
+SERIALIZER = "json"  # serializer of the files for glyph: "json", "ujson" or "msgpack" (json if not installed)
+PRECOMPRESS_OUTPUT = False  # if True, the files for glyph are also written compressed with gzip (.gz) and brotli (.br)
+OUTPUT_MANIFEST_FILE = "visualization_manifest.json"  # sizes, counts and content hashes of the files for glyph
+ROUND_WINDOW = None  # if set, (first, last) rounds of each team added to the team graphs, None to add all the rounds
+ROUNDS_FOLDER = "../data/rounds/"  # folder of the index of the round markers written by check_rounds.py
+# rows read before the first round of a window, to rebuild the context of the team (players, condition, items and mines)
+SETUP_EVENTS = {"PlayerConnection", "SetupMatch", "ItemSetup", "MineSetup", "GameSuspended"}
 
 PLAYERS = [  # players for testing purposes, to be used with the right dataset:  ["af1585u7p7", "Elrric", "sexog53oz3"]
     # "Elrric",
@@ -47,8 +84,6 @@ PLAYERS = [  # players for testing purposes, to be used with the right dataset:
     # "z58lm8leyw"
 ]
 
-TEAMS = []  # teams (picked from file names)
-
 GAME_ACTIONS = [
     "ArrivedTo",
     "CensoredMessage",
@@ -64,24 +99,86 @@ GAME_ACTIONS = [
     "Vote"
 ]
 
-# dictionaries
-# STATES = {}
-TRAJECTORIES = {}
-LINKS = {}
-
-# number of players or teams
-TARGET_COUNT = 0
+SETUP_AND_CONTROL_EVENTS = [
+    "SetupMatch",
+    "ItemSetup",
+    "MineSetup",
+    "GoldSetup",
+    "StartVotation",
+    "LeaderSelection",
+    "TotalGold",
+    "GameSuspended",
+    "END"
+]
 
-# list of file names
-FILE_NAMES_LIST = []
+# event vocabulary: event names are interned as small integer codes, so that event sequences are stored as compact
+# arrays and compared as integers; events missing from the seed below get a new code the first time they are found
+EVENT_NAMES = ["start_game", "end_game"] + SETUP_AND_CONTROL_EVENTS + GAME_ACTIONS
+EVENT_CODES = dict((event, code) for code, event in enumerate(EVENT_NAMES))
+START_GAME_CODE = EVENT_CODES["start_game"]
+END_GAME_CODE = EVENT_CODES["end_game"]
+SETUP_MATCH_CODE = EVENT_CODES["SetupMatch"]
+ITEM_SETUP_CODE = EVENT_CODES["ItemSetup"]
+MINE_SETUP_CODE = EVENT_CODES["MineSetup"]
+START_VOTATION_CODE = EVENT_CODES["StartVotation"]
+VOTE_CODE = EVENT_CODES["Vote"]
+LEADER_SELECTION_CODE = EVENT_CODES["LeaderSelection"]
+TOTAL_GOLD_CODE = EVENT_CODES["TotalGold"]
+GAME_SUSPENDED_CODE = EVENT_CODES["GameSuspended"]
+NEW_LEADER_CODE = EVENT_CODES["NewLeader"]
+CHAT_MESSAGE_CODE = EVENT_CODES["ChatMessage"]
+CENSORED_MESSAGE_CODE = EVENT_CODES["CensoredMessage"]
+ROUND_SEPARATOR_CODE = EVENT_CODES[ROUND_SEPARATOR]
+
+VOCABULARY_LOCK = threading.Lock()  # held while an event is added to the vocabulary shared by all the analyses
+
+
+def event_code(event):
+    """
+    get the code of an event, adding the event to the vocabulary if it is not there yet
+    :param event: the event name
+    :return: the code of the event
+    """
+    code = EVENT_CODES.get(event)
+    if code is None:
+        with VOCABULARY_LOCK:
+            # the event may have been added by another thread since it was looked up
+            code = EVENT_CODES.get(event)
+            if code is None:
+                EVENT_NAMES.append(event)
+                code = EVENT_CODES[event] = len(EVENT_NAMES) - 1
+    return code
+
+
+def export_trajectory(trajectory, event_names):
+    """
+    get a copy of a trajectory whose action meaning is decoded from event codes into event names, to be written in json
+    :param trajectory: the trajectory of a graph
+    :param event_names: the event vocabulary the action meaning has been encoded with
+    :return:
+    """
+    action_meaning = [event_names[code] for code in trajectory['action_meaning']]
+    return {'trajectory': trajectory['trajectory'],
+            'action_meaning': action_meaning,
+            'user_ids': trajectory['user_ids'],
+            # the id is the sequence of the events between the start and the end of the game
+            'id': ''.join(['_' + event for event in action_meaning[1:-1]]),
+            'completed': trajectory['completed']}
 
 
 class Graph:
     def __init__(self):
         self.index = ""  # used to index by, for instance, experimental condition
+        self.target_count = 0  # number of targets (i.e. players or teams) parsed when the graph was last stored
+        self.event_names = EVENT_NAMES  # event vocabulary the action meanings of the trajectories are encoded with
         self.states = {}
         self.trajectories = {}
         self.links = {}
+        self.state_ids = {}  # index of the state ids by label (i.e. the event_type of their details)
+        # sets mirroring the 'user_ids' lists of states and links, used for membership tests:
+        # the lists keep the insertion order of the user ids, so the output is deterministic
+        self.state_users = {}
+        self.link_users = {}
         self.create_initial_and_final_states()
 
     def create_initial_and_final_states(self):
@@ -107,22 +204,48 @@ class Graph:
             'stat': {},
             'user_ids': []}
 
+        self.state_ids['start'] = 0
+        self.state_ids['end'] = 1
+        self.state_users[0] = set()
+        self.state_users[1] = set()
+
+    def index_state(self, state_id, old_label, new_label):
+        """
+        keeps the index of the state ids by label in sync when a state is created or relabeled
+        :param state_id: the id of the state
+        :param old_label: the previous label of the state (None if the state is new)
+        :param new_label: the current label of the state
+        :return:
+        """
+        if old_label is not None and self.state_ids.get(old_label) == state_id:
+            del self.state_ids[old_label]
+        # if several states share a label, the one with the lowest id is found first
+        if new_label not in self.state_ids or self.state_ids[new_label] > state_id:
+            self.state_ids[new_label] = state_id
+
+    def has_target(self, state_id, target):
+        return target in self.state_users[state_id]
+
     def add_target_to_state(self, state_id, target):
-        if target not in self.states[state_id]['user_ids']:
+        users = self.state_users[state_id]
+        if target not in users:
+            users.add(target)
             self.states[state_id]['user_ids'].append(target)
 
     def create_or_update_states(self, state_id, state_type, parent_sequence, details, stat, user_id):
         # print ("state_type :" + str(state_type))
         # print ("details: " + str(details))
         if state_id in self.states:
+            self.index_state(state_id, self.states[state_id]['details']['event_type'], details['event_type'])
             self.states[state_id]['type'] = state_type
             self.states[state_id]['parent_sequence'] = parent_sequence
             self.states[state_id]['details'] = details
             self.states[state_id]['stat'] = stat
 
-            if user_id not in self.states[state_id]['user_ids']:
-                self.states[state_id]['user_ids'].append(user_id)
+            self.add_target_to_state(state_id, user_id)
         else:
+            self.index_state(state_id, None, details['event_type'])
+            self.state_users[state_id] = {user_id}
             self.states[state_id] = {
                 'id': state_id,
                 'type': state_type,
@@ -147,14 +270,8 @@ class Graph:
         # this way we avoid sequence nodes that only go from START to END
         self.add_target_to_state(0, target)
 
-        index = -1
-        for key_iterator, value in self.states.items():
-            existing_event_name = value['details']['event_type']
-
-            # found an existing event: use its index
-            if existing_event_name == event:
-                index = key_iterator
-                break
+        # look up an existing state for the event in the index of the states
+        index = self.state_ids.get(event, -1)
 
         # if the state already exists update it, otherwise create and append it after the last state
         i = index if index > 0 else self.states.__len__()
@@ -177,40 +294,139 @@ class Graph:
         :return:
         """
         for item in range(0, len(trajectory) - 1):
-            uid = str(trajectory[item]) + "_" + str(trajectory[item + 1])  # id: previous node -> current node
-            if uid not in self.links:
-                self.links[uid] = {'id': uid,
-                              'source': trajectory[item],
-                              'target': trajectory[item + 1],
-                              'user_ids': [user_id]}
-            else:
-                users = self.links[uid]['user_ids']
-                users.append(user_id)
-                unique_user_set = list(set(users))
-                self.links[uid]['user_ids'] = unique_user_set
+            self.add_link(trajectory[item], trajectory[item + 1], user_id)
+
+    def add_link(self, source, target, user_id):
+        """
+        adds a link between two nodes, or adds the user id to the link if it already exists
+        :param source: id of the previous node
+        :param target: id of the current node
+        :param user_id:
+        :return:
+        """
+        uid = str(source) + "_" + str(target)  # id: previous node -> current node
+        if uid not in self.links:
+            self.links[uid] = {'id': uid,
+                               'source': source,
+                               'target': target,
+                               'user_ids': [user_id]}
+            self.link_users[uid] = {user_id}
+        elif user_id not in self.link_users[uid]:
+            self.link_users[uid].add(user_id)
+            self.links[uid]['user_ids'].append(user_id)
 
     def clear_graph(self):
         self.trajectories.clear()
         self.states.clear()
         self.links.clear()
+        self.state_ids.clear()
+        self.state_users.clear()
+        self.link_users.clear()
+
+    def close_graph(self, trajectory, target, action_sequence):
+        """
+        close the trajectory of a target with the end state and add it to the trajectories of the graph
+        :param trajectory: the trajectory of the target
+        :param target: the target player or team
+        :param action_sequence: the event codes of the target
+        :return: True if the trajectory has been closed, False if it had already been closed
+        """
+        # a closed sequence ends with END_GAME_CODE: closing it again would add it as a new trajectory,
+        # keyed by a sequence with two END_GAME_CODE
+        if action_sequence and action_sequence[-1] == END_GAME_CODE:
+            return False
 
-    def close_graph(self, trajectory, target, action_sequence, key):
         trajectory.append(1)  # end state
         self.add_target_to_state(1, target)  # update end state with the new user id
-        action_sequence.append("end_game")
+        action_sequence.append(END_GAME_CODE)
+
+        # the trajectory is identified by its sequence of event codes, whose bytes are an exact (collision free)
+        # and compact key: the key string with the event names is only built when the trajectory is exported
+        key = action_sequence.tostring()
 
         self.add_links(trajectory, target)
 
         user_ids = [target]
 
         if key in self.trajectories:
-            self.trajectories[key]['user_ids'].append(target)
+            # a partial graph reduced twice (see reduce_partial_graph) closes its targets again
+            if target not in self.trajectories[key]['user_ids']:
+                self.trajectories[key]['user_ids'].append(target)
         else:
             self.trajectories[key] = {'trajectory': trajectory,
                                       'action_meaning': action_sequence,
                                       'user_ids': user_ids,
                                       'id': key,
                                       'completed': True}
+        return True
+
+    def merge(self, other):
+        """
+        merges another graph into this one: states are unified by label, the state ids used by the trajectories and
+        links of the other graph are remapped onto this graph, user ids are united and trajectories are combined by key
+        :param other: the graph to merge, which is left unchanged
+        :return: dictionary mapping the state ids of the other graph onto the state ids of this graph
+        """
+        state_map = {}
+
+        # visit the states in order of creation, so that new states get their ids in the same order
+        for state_id in sorted(other.states.keys()):
+            state = other.states[state_id]
+            label = state['details']['event_type']
+
+            # the start and end states are the same in every graph
+            if state_id == 0 or state_id == 1:
+                i = state_id
+            else:
+                index = self.state_ids.get(label, -1)
+                i = index if index > 0 else self.states.__len__()
+
+            if i not in self.states:
+                self.index_state(i, None, label)
+                self.state_users[i] = set()
+                self.states[i] = {
+                    'id': i,
+                    'type': state['type'],
+                    'parent_sequence': state['parent_sequence'],
+                    'details': dict(state['details']),
+                    'stat': state['stat'],
+                    'user_ids': []}
+
+            for user_id in state['user_ids']:
+                self.add_target_to_state(i, user_id)
+            state_map[state_id] = i
+
+        for link in other.links.values():
+            for user_id in link['user_ids']:
+                self.add_link(state_map[link['source']], state_map[link['target']], user_id)
+
+        for value in other.trajectories.values():
+            action_meaning = other.encoded_action_meaning(value)
+            key = action_meaning.tostring()
+            if key not in self.trajectories:
+                self.trajectories[key] = {'trajectory': [state_map[state_id] for state_id in value['trajectory']],
+                                          'action_meaning': action_meaning,
+                                          'user_ids': [],
+                                          'id': key,
+                                          'completed': value['completed']}
+            # user ids are united, as for states and links, so merging graphs that share users adds no duplicates
+            user_ids = self.trajectories[key]['user_ids']
+            for user_id in value['user_ids']:
+                if user_id not in user_ids:
+                    user_ids.append(user_id)
+
+        return state_map
+
+    def encoded_action_meaning(self, trajectory):
+        """
+        get a copy of the action meaning of a trajectory of this graph, encoded with the event vocabulary of this
+        process (graphs built in other processes may have encoded it with different codes)
+        :param trajectory: the trajectory of this graph
+        :return:
+        """
+        if self.event_names is EVENT_NAMES:
+            return array('H', trajectory['action_meaning'])
+        return array('H', [event_code(self.event_names[code]) for code in trajectory['action_meaning']])
 
 
 # def create_initial_and_final_states():
@@ -263,25 +479,117 @@ class Graph:
 #             'user_ids': [user_id]}
 
 
-def add_links(trajectory, user_id):
+class ProcessingContext:
+    """
+    state of an analysis, mutated while the raw data files are parsed: each analysis has its own context, so that
+    several analyses can run in the same process, in parallel threads, or in a long-lived service;
+    the settings of the analysis (events to process, state criterion and round window) are kept here, taken from the
+    module settings unless they are given, and are not changed by the parsers
+    """
+    def __init__(self, players=None, settings=None):
+        """
+        :param players: players whose trajectories are built (default: PLAYERS); more are found in the files
+        :param settings: dictionary of the settings of the analysis (see settings), each one defaulting to the module
+        setting (EVENTS_TO_PROCESS, SIMPLE_STATE_CRITERION and ROUND_WINDOW)
+        """
+        settings = settings or {}
+        self.events_to_process = set(settings.get('events_to_process', EVENTS_TO_PROCESS))
+        self.simple_state_criterion = settings.get('simple_state_criterion', SIMPLE_STATE_CRITERION)
+        round_window = settings.get('round_window', ROUND_WINDOW)
+        self.round_window = tuple(round_window) if round_window is not None else None
+        self.validate_settings()
+        self.handler_tables = {}  # handler tables compiled by compile_handlers, indexed by the settings they need
+        self.rounds_index = None  # index of the round markers of the files, loaded when a round window is read
+        self.mining_tools = {}  # mining tools available to the team, with their probability of success
+        self.mines = {}  # mines available to the team, with their min and max probability of success
+        self.graphs = {}  # graphs indexed by experimental condition
+        self.visualizations = {}  # graphs to visualize, indexed by experimental condition
+        self.target_count = 0  # number of players or teams
+        self.single_graph = None  # graph of the file parsed by process_data
+        self.teams = []  # teams (picked from file names)
+        self.players = list(PLAYERS if players is None else players)
+        self.trajectories = {}  # trajectories of the single players
+        self.links = {}  # links of the trajectories of the single players
+        self.file_names = []  # names of the files for glyph, listed in visualization_ids
+        self.output_manifest = {}  # entries of the manifest of the files for glyph, indexed by name
+
+    def clear_items(self):
+        """
+        clear the mining tools and mines of the team that has been parsed
+        :return:
+        """
+        self.mining_tools.clear()
+        self.mines.clear()
+
+    def validate_settings(self):
+        """
+        check that the settings of the analysis can be processed, before any file is parsed
+        :return:
+        """
+        # the derived events are only added as string based states: the other state criterion needs add_event,
+        # which has never been implemented, so it would silently drop them
+        derived_events = DERIVED_EVENTS & self.events_to_process
+        if derived_events and not self.simple_state_criterion:
+            raise ValueError("the derived events (" + ", ".join(sorted(derived_events)) + ") are only added as string "
+                             "based states, so they need the simple state criterion (SIMPLE_STATE_CRITERION)")
+        if self.round_window is not None and not 1 <= self.round_window[0] <= self.round_window[1]:
+            raise ValueError("the round window must be a pair of rounds (first, last) with 1 <= first <= last")
+
+    def settings(self):
+        """
+        :return: dictionary of the settings of the analysis, to create a context with the same settings (for instance
+        in a worker process)
+        """
+        return {'events_to_process': sorted(self.events_to_process),
+                'simple_state_criterion': self.simple_state_criterion,
+                'round_window': list(self.round_window) if self.round_window is not None else None}
+
+    def file_markers(self, path):
+        """
+        :param path: path of a raw data file
+        :return: the round markers of the file (see check_rounds.file_markers), taken from the index in ROUNDS_FOLDER
+        if it is up to date, which is loaded the first time
+        """
+        if self.rounds_index is None:
+            self.rounds_index = check_rounds.load_rounds_index(ROUNDS_FOLDER)
+        return check_rounds.file_markers(path, self.rounds_index)
+
+    def worker_arguments(self, input_folder, filename):
+        """
+        :param input_folder: folder containing raw data files
+        :param filename: name of a team file
+        :return: the arguments of parse_team_file for the file: the worker processes parse it with the settings of
+        this context and, if a round window is set, with the entry of the file in the index of the round markers
+        """
+        rounds_index = None
+        if self.round_window is not None:
+            if self.rounds_index is None:
+                self.rounds_index = check_rounds.load_rounds_index(ROUNDS_FOLDER)
+            entry = self.rounds_index.get(filename)
+            rounds_index = {filename: entry} if entry is not None else {}
+        return input_folder, filename, self.settings(), rounds_index
+
+
+def add_links(context, trajectory, user_id):
     """
     adds link between the consecutive nodes of the trajectory
+    :param context: the processing context
     :param trajectory:
     :param user_id:
     :return:
     """
     for item in range(0, len(trajectory) - 1):
         uid = str(trajectory[item]) + "_" + str(trajectory[item + 1])  # id: previous node -> current node
-        if uid not in LINKS:
-            LINKS[uid] = {'id': uid,
-                          'source': trajectory[item],
-                          'target': trajectory[item + 1],
-                          'user_ids': [user_id]}
+        if uid not in context.links:
+            context.links[uid] = {'id': uid,
+                                  'source': trajectory[item],
+                                  'target': trajectory[item + 1],
+                                  'user_ids': [user_id]}
         else:
-            users = LINKS[uid]['user_ids']
+            users = context.links[uid]['user_ids']
             users.append(user_id)
             unique_user_set = list(set(users))
-            LINKS[uid]['user_ids'] = unique_user_set
+            context.links[uid]['user_ids'] = unique_user_set
 
 
 def roundup(x):
@@ -349,27 +657,27 @@ def roundup(x):
 #         action_sequence.append(i)
 
 
-def close_graph(trajectory, target, action_sequence, key):
+def close_graph(context, trajectory, target, action_sequence, key):
     trajectory.append(1)  # end state
     # TODO: uncomment and massage next line
     # add_target_to_state(1, target)  # update end state with the new user id
     action_sequence.append("end_game")
 
-    add_links(trajectory, target)
+    add_links(context, trajectory, target)
 
     user_ids = [target]
 
-    if key in TRAJECTORIES:
-        TRAJECTORIES[key]['user_ids'].append(target)
+    if key in context.trajectories:
+        context.trajectories[key]['user_ids'].append(target)
     else:
-        TRAJECTORIES[key] = {'trajectory': trajectory,
-                             'action_meaning': action_sequence,
-                             'user_ids': user_ids,
-                             'id': key,
-                             'completed': True}
+        context.trajectories[key] = {'trajectory': trajectory,
+                                     'action_meaning': action_sequence,
+                                     'user_ids': user_ids,
+                                     'id': key,
+                                     'completed': True}
 
 
-def process_gold(row, column, gold_counter, accumulation, target, trajectory, action_meaning):
+def process_gold(context, row, column, gold_counter, accumulation, target, trajectory, action_meaning):
     gold_found = int(row[column])
     if accumulation:
         gold_counter = gold_counter + gold_found
@@ -393,732 +701,789 @@ def process_gold(row, column, gold_counter, accumulation, target, trajectory, ac
 #     LINKS.clear()
 
 
-def process_single_players(input_file, file_reader):
-    for player in PLAYERS:
-
-        # uncomment next line to experiment only with specific players
-        # if player == "z58lm8leyw" or player == "zvq9c5v9gd":
-
-        gold_counter = 0
-        round_counter = 1
-        items_selected = set()
-        items_used = set()
-        trajectory = [0]  # initialize trajectory with start state
-        action_sequence = ["start_game"]  # used to document the action sequence contained in each trajectory
-        key = ""
-        new_round = False  # flag used to get the player position when a new round starts
-        initial_x = 0  # initial x position of the player when a new round starts
-        initial_y = 0  # initial y position of the player when a new round starts
-        distance_covered = 0  # total distance covered by the player while moving
+class PlayerTrajectoryBuilder:
+    """
+    builds the trajectory of a single player from the rows routed to it by process_single_players
+    """
+    def __init__(self, context, player):
+        self.context = context
+        self.player = player
+        self.gold_counter = 0
+        self.items_used = set()
+        self.trajectory = [0]  # initialize trajectory with start state
+        self.action_sequence = ["start_game"]  # used to document the action sequence contained in each trajectory
+        self.key = ""
+        self.new_round = False  # flag used to get the player position when a new round starts
+        self.initial_x = 0  # initial x position of the player when a new round starts
+        self.initial_y = 0  # initial y position of the player when a new round starts
+        self.distance_covered = 0  # total distance covered by the player while moving
 
         # TODO: uncomment and massage next line
         # add_target_to_state(0, player)  # update START state with new user id
 
-        # "reset" the CSV iterator by resetting the read position of the file object,
-        # otherwise the inner loop processes the csv file only once
-        input_file.seek(0)
-
-        # update the player's trajectory by processing each row
-        for row in file_reader:
-
-            action = row[EVENT_COLUMN]
-
-            if action == "LeaderSelection":
-                items_selected.add(row[ITEM_SELECTED_COLUMN])
-
-            if len(row) > PLAYER_ID_COLUMN and row[PLAYER_ID_COLUMN] == player:
-                key += ('_' + action)  # generate the key for the trajectory as a sequence of action strings
-                # append the action here (NOT when gold is found, otherwise only FoundGold is appended)
-                action_sequence.append(action)
-
-                if action == "UseItem":
-                    items_used.add(row[ITEM_COLUMN])
-
-                if "gold" in EVENTS_TO_PROCESS and action == "FoundGold":
-                    gold_counter = process_gold(row, FOUND_GOLD_COLUMN, gold_counter, True, player, trajectory,
-                                                action_sequence)
-
-                # TODO: if covered distance is useful, convert the code for processing it into a function
-                if "distance" in EVENTS_TO_PROCESS and action == "ArrivedTo":
-                    if new_round:
-                        # get the player's initial position at the start of the new round
-                        initial_position = row[POSITION_COLUMN]
-                        initial_position = initial_position.translate(None, '()').split()
-                        initial_x = int(initial_position[0])
-                        initial_y = int(initial_position[1])
-                        # reset the flag that triggers the getting of the initial position
-                        new_round = False
-                    else:
-                        position = row[POSITION_COLUMN]
-                        position = position.translate(None, '()').split()
-                        print("player " + player + " position: " + str(position))
-                        x = int(position[0])
-                        y = int(position[1])
-                        distance_covered = distance_covered + abs(x - initial_x) + abs(y - initial_y)
-                        initial_x = x
-                        initial_y = y
-                        print("distance_covered: " + str(distance_covered))
-
-                        # create a new state every time total distance has increased by DIVISOR (approximate)
-                        rest_of_division = (float(distance_covered) / DISTANCE_INCREASE) % 1.0
-                        remainder = 1.0 - rest_of_division
-                        if remainder == 1.0 or remainder <= 0.02:
-                            rounded_distance_counter = roundup(distance_covered)
-                            # TODO: uncomment and massage next line
-                            # add_event("distance:", rounded_distance_counter, player, trajectory, action_sequence, None, None)
-
-            if "round" in EVENTS_TO_PROCESS and action == ROUND_SEPARATOR:
-                # start creating new states based on rounds after the first gold_setup (because
-                # the very first one occurs at the beginning of the game) and avoid
-                # updating the action sequence because rounds are not player's actions
-                if round_counter >= 1:
+    def add_row(self, row, action):
+        """
+        updates the player's trajectory with a row containing one of the player's actions
+        :param row: the csv row
+        :param action: the action contained in the row
+        :return:
+        """
+        self.key += ('_' + action)  # generate the key for the trajectory as a sequence of action strings
+        # append the action here (NOT when gold is found, otherwise only FoundGold is appended)
+        self.action_sequence.append(action)
+
+        if action == "UseItem":
+            self.items_used.add(row[ITEM_COLUMN])
+
+        if "gold" in self.context.events_to_process and action == "FoundGold":
+            self.gold_counter = process_gold(self.context, row, FOUND_GOLD_COLUMN, self.gold_counter, True,
+                                             self.player, self.trajectory, self.action_sequence)
+
+        # TODO: if covered distance is useful, convert the code for processing it into a function
+        if "distance" in self.context.events_to_process and action == "ArrivedTo":
+            if self.new_round:
+                # get the player's initial position at the start of the new round
+                initial_position = row[POSITION_COLUMN]
+                initial_position = initial_position.translate(None, '()').split()
+                self.initial_x = int(initial_position[0])
+                self.initial_y = int(initial_position[1])
+                # reset the flag that triggers the getting of the initial position
+                self.new_round = False
+            else:
+                position = row[POSITION_COLUMN]
+                position = position.translate(None, '()').split()
+                print("player " + self.player + " position: " + str(position))
+                x = int(position[0])
+                y = int(position[1])
+                self.distance_covered = self.distance_covered + abs(x - self.initial_x) + abs(y - self.initial_y)
+                self.initial_x = x
+                self.initial_y = y
+                print("distance_covered: " + str(self.distance_covered))
+
+                # create a new state every time total distance has increased by DIVISOR (approximate)
+                rest_of_division = (float(self.distance_covered) / DISTANCE_INCREASE) % 1.0
+                remainder = 1.0 - rest_of_division
+                if remainder == 1.0 or remainder <= 0.02:
+                    rounded_distance_counter = roundup(self.distance_covered)
                     # TODO: uncomment and massage next line
-                    # add_event("round", round_counter, player, trajectory, None, items_selected, None)
-                    print("added round event num: " + str(round_counter))
+                    # add_event("distance:", rounded_distance_counter, self.player, self.trajectory, self.action_sequence, None, None)
+
+    def close(self):
+        close_graph(self.context, self.trajectory, self.player, self.action_sequence, self.key)
+
+
+def process_single_players(context, input_file, file_reader):
+    """
+    demultiplexes the rows of the csv file onto one trajectory builder per player, reading the file only once
+    :param context: the processing context
+    :param input_file: input file
+    :param file_reader: csv reader of the input file
+    :return:
+    """
+    # builders indexed by player, plus the list of players in the order their builders were created
+    builders = {}
+    players = []
+    for player in context.players:
+        if player not in builders:
+            builders[player] = PlayerTrajectoryBuilder(context, player)
+            players.append(player)
+
+    # the round counter and the selected items are team-wide, so they are shared by all the builders
+    round_counter = 1
+    items_selected = set()
 
-                round_counter = round_counter + 1
-                items_selected.clear()
+    # update the players' trajectories by routing each row to the builder of its player
+    for row in file_reader:
 
-        # ------ close states, trajectories and links, update target count, clear mining tools
-        close_graph(trajectory, player, action_sequence, key)
+        action = row[EVENT_COLUMN]
+
+        if action == "LeaderSelection":
+            items_selected.add(row[ITEM_SELECTED_COLUMN])
+
+        if len(row) > PLAYER_ID_COLUMN:
+            player = row[PLAYER_ID_COLUMN]
+
+            # players are found while reading the file, so no pre-scan with find_players() is needed
+            if action == "PlayerConnection" and player not in builders:
+                context.players.append(player)
+                builders[player] = PlayerTrajectoryBuilder(context, player)
+                players.append(player)
+
+            builder = builders.get(player)
+            if builder is not None:
+                builder.add_row(row, action)
+
+        if "round" in context.events_to_process and action == ROUND_SEPARATOR:
+            # start creating new states based on rounds after the first gold_setup (because
+            # the very first one occurs at the beginning of the game) and avoid
+            # updating the action sequence because rounds are not player's actions
+            if round_counter >= 1:
+                # TODO: uncomment and massage next line
+                # for player in players:
+                #     add_event("round", round_counter, player, builders[player].trajectory, None, items_selected, None)
+                print("added round event num: " + str(round_counter))
+
+            round_counter = round_counter + 1
+            items_selected.clear()
+
+    # ------ close states, trajectories and links, update target count, clear mining tools
+    for player in players:
+        builders[player].close()
 
         # increase the count of targets
-        global TARGET_COUNT
-        TARGET_COUNT = TARGET_COUNT + 1
+        context.target_count = context.target_count + 1
+
+    # clear the mining tools and mines
+    context.clear_items()
+
+
+class RunningStats:
+    """
+    running count, mean and variance of a series of values, updated online with Welford's algorithm in constant memory
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of the squared differences from the mean
+
+    def add(self, value):
+        self.count = self.count + 1
+        delta = value - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (value - self.mean)
+
+    def variance(self):
+        """
+        :return: the sample variance of the values (0 if there are less than 2 values)
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def stdev(self):
+        """
+        :return: the sample standard deviation of the values (0 if there are less than 2 values)
+        """
+        return math.sqrt(self.variance())
+
+
+class RoundAggregates:
+    """
+    aggregates of the decisions of a team in a round, updated online by the event handlers: the round based state
+    labels and the rows of the team x round feature table (see round_features.py) are derived from them,
+    and they are replaced when the round ends
+    """
+    def __init__(self):
+        # probabilities of success of the mining tools voted (a mine has a range of probabilities, so the votes on
+        # the mines are not counted)
+        self.tool_votes = RunningStats()
+        self.selected = RunningStats()  # probabilities of success of the items selected by the leader
+        self.risk_counts = {}  # number of decisions of each risk
+        self.risks = []  # risks of the decisions, in order, as listed by the round+risk label
+        self.leader_changes = 0  # number of NewLeader events
+        self.chat_messages = 0  # number of ChatMessage events
+        self.censored_messages = 0  # number of CensoredMessage events
+
+    def add_risk(self, risk_taken):
+        self.risk_counts[risk_taken] = self.risk_counts.get(risk_taken, 0) + 1
+        self.risks.append(risk_taken)
+
+    def risk_aversion(self):
+        """
+        :return: the risk aversion shown by the average probability of success of the items selected in the round,
+        "" if no item has been selected
+        """
+        if self.selected.count == 0:
+            return ""
+        avg_selected_item_success_prob = round(self.selected.mean, 2)
+        if avg_selected_item_success_prob <= RISK_THRESHOLD_LOW:
+            return "low"
+        elif avg_selected_item_success_prob <= RISK_THRESHOLD_MEDIUM:
+            return "medium"
+        return "high"
+
+
+def handle_setup_match(machine, row):
+    machine.exp_cond = "Competition" + row[COMPETITION_LEVEL_COLUMN]
+    graphs = machine.context.graphs
+    if machine.exp_cond not in graphs:
+        # add the new graph of the team to the dictionary of experimental conditions
+        graphs[machine.exp_cond] = machine.graph
+    else:
+        # get the graph corresponding to the current experimental condition
+        machine.graph = graphs[machine.exp_cond]
+
+
+def handle_item_setup(machine, row):
+    machine.context.mining_tools[row[ITEM_COLUMN]] = row[ITEM_PROBABILITY_COLUMN]
+
+
+def handle_mine_setup(machine, row):
+    # mines have a min and max probability of success
+    prob_list = row[ITEM_PROBABILITY_COLUMN].translate(None, '()').split()
+    machine.context.mines[row[ITEM_COLUMN]] = [float(prob_list[0]), float(prob_list[1])]
+
+
+def handle_start_votation(machine, row):
+    mining_tools = machine.context.mining_tools
+    mines = machine.context.mines
+    machine.item1 = row[START_VOTATION_COLUMN_1]
+    item2 = row[START_VOTATION_COLUMN_2]
+
+    if machine.item1.find("Mine") > -1:
+        machine.item1_prob = mines[machine.item1][0]
+    else:
+        machine.item1_prob = float(mining_tools[machine.item1])
+
+    if item2.find("Mine") > -1:
+        machine.item2_prob = mines[item2][0]
+    else:
+        machine.item2_prob = float(mining_tools[item2])
+
+
+def handle_vote(machine, row):
+    item = row[ITEM_VOTED_COLUMN]
+    if item in machine.context.mining_tools:
+        probability = float(machine.context.mining_tools[item])
+        machine.votation.add(probability)
+        machine.round_aggregates.tool_votes.add(probability)
+
+
+def handle_voting_st_dev(machine, row):
+    # compute st_dev of the votes since the last selection and create a state based on it
+    if machine.votation.count > 1:
+        # rounded so that the rounding errors of the online variance do not move a st_dev on the edge of a bin
+        st_dev = round(machine.votation.stdev(), ST_DEV_DECIMALS)
+        if st_dev == 0:
+            st_dev_bin = "None"
+        elif 0 < st_dev <= 0.35:
+            st_dev_bin = "Small"
+        elif st_dev > 0.35:
+            st_dev_bin = "Large"
+        event_to_add = ("st_dev r" + str(machine.round_counter) + ": " + str(st_dev_bin) +
+                        " voters: " + str(machine.votation.count))
+        machine.graph.add_event_string_based(event_to_add, "mid", machine.team, machine.trajectory, None)
+
+    # reset votes and voters
+    machine.votation = RunningStats()
+
+
+def classify_risk(item1_prob, item2_prob, selected_first):
+    """
+    classify the risk taken by the leader choosing between two items, and the risk proneness it shows
+    (see risk.classify_risks for the decisions of a whole session)
+    :param item1_prob: probability of success of the first item to choose from
+    :param item2_prob: probability of success of the second item to choose from
+    :param selected_first: True if the leader selected the first item
+    :return: the risk ("n.a.", "negligible", "low" or "high") and the risk proneness ("" if the risk is not high)
+    """
+    difference_between_risks = float(abs(item1_prob - item2_prob))
+
+    if item1_prob == item2_prob:
+        risk_taken = "n.a."
+    elif difference_between_risks <= RISK_DIFFERENCE_NEGLIGIBLE:
+        risk_taken = "negligible"
+    elif selected_first and item1_prob < item2_prob:
+        risk_taken = "high"
+    else:
+        risk_taken = "low"
+
+    risk_proneness = ""
+    if risk_taken == "high":
+        if difference_between_risks <= PRONENESS_DIFFERENCE_LOW:
+            risk_proneness = "low"
+        elif difference_between_risks < PRONENESS_DIFFERENCE_HIGH:
+            risk_proneness = "medium"
+        else:
+            risk_proneness = "high"
+    return risk_taken, risk_proneness
+
+
+def handle_leader_selection(machine, row):
+    item = row[ITEM_SELECTED_COLUMN]
+    machine.risk = ""
+    machine.risk_proneness = ""
+    if item in machine.context.mining_tools or item in machine.context.mines:
+        machine.risk, machine.risk_proneness = classify_risk(machine.item1_prob, machine.item2_prob,
+                                                             item == machine.item1)
+        machine.round_aggregates.add_risk(machine.risk)
+
+
+def handle_classified_risk(machine, row):
+    # the risk of the decision has been classified with the other decisions of the session (see feed_cached)
+    machine.risk, machine.risk_proneness = next(machine.decisions)
+    if machine.risk != "":
+        machine.round_aggregates.add_risk(machine.risk)
+
+
+def handle_selection(machine, row):
+    item = row[ITEM_SELECTED_COLUMN]
+    if item in machine.context.mining_tools:
+        machine.round_aggregates.selected.add(float(machine.context.mining_tools[item]))
+    elif item in machine.context.mines:
+        machine.round_aggregates.selected.add(machine.context.mines[item][0])
+
+
+def handle_risk_proneness(machine, row):
+    if machine.risk_proneness != "":
+        event_to_add = "risk_proneness" + ": " + machine.risk_proneness
+        machine.graph.add_event_string_based(event_to_add, "mid", machine.team, machine.trajectory, None)
+
+
+def handle_risk(machine, row):
+    if machine.risk != "":
+        event_to_add = "r" + str(machine.round_counter) + ":" + "risk " + machine.risk
+        machine.graph.add_event_string_based(event_to_add, "mid", machine.team, machine.trajectory, None)
+
+
+def handle_gold(machine, row):
+    machine.gold_counter = process_gold(machine.context, row, TOTAL_GOLD_COLUMN, False, machine.gold_counter,
+                                        machine.team, machine.trajectory, machine.event_sequence)
+
+
+def handle_total_gold(machine, row):
+    machine.gold_counter = int(row[TOTAL_GOLD_COLUMN])
+
+
+def handle_new_leader(machine, row):
+    machine.round_aggregates.leader_changes = machine.round_aggregates.leader_changes + 1
+
+
+def handle_chat_message(machine, row):
+    machine.round_aggregates.chat_messages = machine.round_aggregates.chat_messages + 1
+
+
+def handle_censored_message(machine, row):
+    machine.round_aggregates.censored_messages = machine.round_aggregates.censored_messages + 1
+
+
+def handle_start_of_round(machine, row):
+    # a ROUND_SEPARATOR row starts a round: record the round it ends, unless the rows before it are the setup of
+    # the game (the last round is recorded when the team is closed)
+    if machine.round_started:
+        machine.record_round()
+    machine.round_started = True
+
 
-        # clear the mining tools and mines
-        MINING_TOOLS.clear()
-        MINES.clear()
+def handle_risk_aversion(machine, row):
+    risk_aversion = machine.round_aggregates.risk_aversion()
+    if machine.round_counter >= 1 and risk_aversion != "":
+        event_to_add = "risk_aversion r" + str(machine.round_counter) + ": " + risk_aversion
+        machine.graph.add_event_string_based(event_to_add, "mid", machine.team, machine.trajectory, None)
 
 
-def parse_data_to_json_format(csv_reader, data_file):
+def handle_round(machine, row):
+    # add the round event and avoid updating action sequence because rounds are not team's actions
+    if machine.round_counter >= 1:
+        event_to_add = "round " + str(machine.round_counter)
+        machine.graph.add_event_string_based(event_to_add, "round", machine.team, machine.trajectory, None)
+
+
+def handle_round_risk(machine, row):
+    risks = machine.round_aggregates.risks
+    if machine.round_counter >= 1 and risks.__len__() > 0:
+        event_to_add = "round+risk" + str(machine.round_counter) + ": " + str(risks)
+        machine.graph.add_event_string_based(event_to_add, "round", machine.team, machine.trajectory, None)
+
+
+def handle_next_round(machine, row):
+    machine.round_counter = machine.round_counter + 1
+    machine.round_aggregates = RoundAggregates()
+
+
+def compile_handlers(events_to_process, per_condition=False, classified_risks=False, round_features=False):
+    """
+    build the table of the handlers of each event code needed by the events to process, so that each row costs one
+    lookup: events that no analysis needs have no handler; the handlers of a code are called in order with the
+    TeamSessionMachine of the team and the row, after the code has been appended to the event sequence of the team
+    :param events_to_process: the events to process (see EVENTS_TO_PROCESS)
+    :param per_condition: if True, the team is added to the graph of its experimental condition (see ProcessingContext)
+    :param classified_risks: if True, the risks of the decisions are classified in batch before the rows are parsed
+    (see TeamSessionMachine.feed_cached), so the items to choose from are not needed
+    :param round_features: if True, the aggregates of each round are recorded when the round ends (see
+    TeamSessionMachine.rounds)
+    :return: dictionary of the lists of handlers, indexed by event code
+    """
+    handlers = {}
+
+    def register(code, handler):
+        # a handler needed by several events is called only once
+        if handler not in handlers.setdefault(code, []):
+            handlers[code].append(handler)
+
+    risk_events = {"risk", "risk_proneness", "round+risk"} & set(events_to_process)
+    if per_condition:
+        register(SETUP_MATCH_CODE, handle_setup_match)
+    register(ITEM_SETUP_CODE, handle_item_setup)
+    register(MINE_SETUP_CODE, handle_mine_setup)
+    if (risk_events or round_features) and not classified_risks:
+        register(START_VOTATION_CODE, handle_start_votation)
+
+    if "voting_st_dev" in events_to_process:
+        register(VOTE_CODE, handle_vote)
+        register(LEADER_SELECTION_CODE, handle_voting_st_dev)
+    if risk_events:
+        register(LEADER_SELECTION_CODE, handle_classified_risk if classified_risks else handle_leader_selection)
+    if "risk_proneness" in events_to_process:
+        register(LEADER_SELECTION_CODE, handle_risk_proneness)
+    if "risk" in events_to_process:
+        register(LEADER_SELECTION_CODE, handle_risk)
+    if "risk_aversion" in events_to_process:
+        register(LEADER_SELECTION_CODE, handle_selection)
+        register(ROUND_SEPARATOR_CODE, handle_risk_aversion)
+    if "round" in events_to_process:
+        register(ROUND_SEPARATOR_CODE, handle_round)
+    if "round+risk" in events_to_process:
+        register(ROUND_SEPARATOR_CODE, handle_round_risk)
+    if "gold" in events_to_process:
+        register(TOTAL_GOLD_CODE, handle_gold)
+    if round_features:
+        register(VOTE_CODE, handle_vote)
+        register(LEADER_SELECTION_CODE, handle_classified_risk if classified_risks else handle_leader_selection)
+        register(LEADER_SELECTION_CODE, handle_selection)
+        register(TOTAL_GOLD_CODE, handle_total_gold)
+        register(NEW_LEADER_CODE, handle_new_leader)
+        register(CHAT_MESSAGE_CODE, handle_chat_message)
+        register(CENSORED_MESSAGE_CODE, handle_censored_message)
+        register(ROUND_SEPARATOR_CODE, handle_start_of_round)
+    register(ROUND_SEPARATOR_CODE, handle_next_round)
+    return handlers
+
+
+def event_handlers(context, per_condition=False, classified_risks=False, round_features=False):
+    """
+    :param context: the processing context, whose events are processed and which keeps the compiled handler tables
+    :param per_condition: if True, the team is added to the graph of its experimental condition (see ProcessingContext)
+    :param classified_risks: if True, the risks of the decisions are classified in batch (see compile_handlers)
+    :param round_features: if True, only the aggregates of the rounds are recorded, and the events to process are
+    ignored
+    :return: the handler table of the events to process, compiled the first time it is needed
+    """
+    events_to_process = set() if round_features else context.events_to_process
+    settings = (frozenset(events_to_process), per_condition, classified_risks, round_features)
+    if settings not in context.handler_tables:
+        context.handler_tables[settings] = compile_handlers(events_to_process, per_condition, classified_risks,
+                                                            round_features)
+    return context.handler_tables[settings]
+
+
+class TeamSessionMachine:
+    """
+    incremental parser of the rows of a team: the rows are fed one at a time (or in batch from a columnar event cache)
+    to the handlers of their events (see compile_handlers), which read and update the state of the team kept here
+    """
+    def __init__(self, context, team, graph, per_condition=False, concatenated=False, round_features=False):
+        """
+        :param context: the processing context
+        :param team: the team (its filename)
+        :param graph: the graph the team is added to
+        :param per_condition: if True, the team is added to the graph of its experimental condition instead
+        :param concatenated: True if the rows come from a file of several teams, where the GameSuspended row
+        is still added to the event sequence of the team
+        :param round_features: if True, the aggregates of the rounds are recorded in rounds instead of adding states
+        to the graph (see round_features.py): a round starts with its ROUND_SEPARATOR row and ends with the next one,
+        or with the team
+        """
+        self.context = context
+        self.team = team
+        self.graph = graph  # replaced by the graph of the experimental condition of the team, if any
+        self.per_condition = per_condition
+        self.round_features = round_features
+        self.handlers = event_handlers(context, per_condition, round_features=round_features)
+        self.concatenated = concatenated
+        self.processing = True  # False once the game is suspended or the team is closed
+        self.closed = False
+        self.exp_cond = ""
+        self.gold_counter = 0
+        self.round_counter = first_round(context)
+        self.item1 = ""
+        self.item1_prob = 0
+        self.item2_prob = 0
+        self.votation = RunningStats()  # probabilities of success of the items voted since the last selection
+        self.round_aggregates = RoundAggregates()
+        self.rounds = []  # (round, gold of the team when it ends, RoundAggregates) of each round ended, if recorded
+        self.round_started = False  # True once a ROUND_SEPARATOR row has started the first round, if recorded
+        self.risk = ""  # risk of the last item selected, "" if the item is not a mining tool or a mine
+        self.risk_proneness = ""  # risk proneness shown by the last item selected, "" if the risk is not high
+        self.decisions = None  # iterator over the risks classified in batch by feed_cached
+        self.trajectory = [0]  # initialize with start state
+        self.event_sequence = array('H', [START_GAME_CODE])
+
+    def feed(self, row):
+        """
+        parse a row of the team
+        :param row: the csv row
+        :return:
+        """
+        code = event_code(row[EVENT_COLUMN])
+
+        # if the game is suspended, stop processing the current team
+        if code == GAME_SUSPENDED_CODE and not self.concatenated:
+            self.processing = False
+
+        if self.processing:
+            # append the event to the sequence of actions, which distinguishes sequence graph nodes
+            # (i.e. players or teams); the event is appended here, NOT when specific events happen,
+            # otherwise only those events are appended
+            self.event_sequence.append(code)
+            for handler in self.handlers.get(code, ()):
+                handler(self, row)
+
+        if code == GAME_SUSPENDED_CODE:
+            self.processing = False
+
+    def feed_rows(self, rows):
+        """
+        parse the rows of the team, in batch if they are read from a columnar event cache
+        :param rows: iterable of the rows
+        :return:
+        """
+        if event_cache is not None and isinstance(rows, event_cache.CachedRows):
+            self.feed_cached(rows)
+        else:
+            feed = self.feed
+            for row in rows:
+                feed(row)
+
+    def feed_cached(self, rows):
+        """
+        parse the rows of a columnar event cache in batch: their events are translated into event codes at once and
+        appended to the event sequence in runs, and only the rows of the events that have handlers are decoded;
+        the risks of all the decisions are classified at once (see risk.session_risks) when numpy is available
+        :param rows: the cached rows (see event_cache.CachedRows)
+        :return:
+        """
+        # all the events are added to the vocabulary, also those after the game is suspended, as when fed one by one
+        codes = rows.encode_events(event_code)
+        if not self.processing:
+            return
+
+        stop = len(codes)
+        suspensions = event_cache.find_codes(codes, [GAME_SUSPENDED_CODE])
+        if suspensions:
+            stop = suspensions[0] + (1 if self.concatenated else 0)
+
+        handlers = self.handlers
+        if risk is not None and handle_leader_selection in handlers.get(LEADER_SELECTION_CODE, ()):
+            decisions = risk.session_risks(rows, codes[:stop],
+                                           (START_VOTATION_CODE, LEADER_SELECTION_CODE, ITEM_SETUP_CODE,
+                                            MINE_SETUP_CODE),
+                                           RISK_DIFFERENCE_NEGLIGIBLE, PRONENESS_DIFFERENCE_LOW,
+                                           PRONENESS_DIFFERENCE_HIGH)
+            if decisions is not None:
+                self.decisions = iter(decisions)
+                handlers = event_handlers(self.context, self.per_condition, classified_risks=True,
+                                          round_features=self.round_features)
+
+        start = 0
+        for position in event_cache.find_codes(codes[:stop], handlers.keys()):
+            self.event_sequence.fromstring(codes[start:position + 1].tostring())
+            row = rows.row(position)
+            for handler in handlers[int(codes[position])]:
+                handler(self, row)
+            start = position + 1
+        self.event_sequence.fromstring(codes[start:stop].tostring())
+        self.decisions = None
+
+        if suspensions:
+            self.processing = False
+
+    def close(self):
+        """
+        close the trajectory of the team, if the team is in at least 1 actual state (i.e. it is a target of the
+        START state); the rows fed afterwards are ignored
+        :return: True if the trajectory has been closed now, False if the team has no actual state or has already
+        been closed
+        """
+        closed = False
+        if self.round_features and self.round_started and not self.closed:
+            # the last round ends with the team
+            self.record_round()
+        if not self.closed and self.graph.has_target(0, self.team):
+            closed = self.graph.close_graph(self.trajectory, self.team, self.event_sequence)
+        self.processing = False
+        self.closed = True
+        return closed
+
+    def record_round(self):
+        """
+        record the aggregates of the current round, numbered by the ROUND_SEPARATOR row that started it, with the
+        gold collected by the team when it ends
+        :return:
+        """
+        self.rounds.append((len(self.rounds) + 1, self.gold_counter, self.round_aggregates))
+
+
+def parse_data_to_json_format(context, csv_reader, data_file):
     """
     parse csv data to create node, link and trajectory
+    :param context: the processing context, whose single graph is replaced by the graph of the file
     :param csv_reader: raw csv data
     :param data_file: input file
     :return:
     """
 
-    # initialize the global graph
-    global SINGLE_GRAPH
-    SINGLE_GRAPH = Graph()
-
-    if FOCUS == "single_players" and len(PLAYERS) > 0:
-        process_single_players(data_file, csv_reader)
-    elif FOCUS == "teams" and len(TEAMS) > 0:
-        # "reset" the CSV iterator by resetting the read position of the file object,
-        # otherwise the inner loop processes the csv file only once
-        data_file.seek(0)
-
-        # initialize variables
-        gold_counter = 0
-        round_counter = 1
-        items_selected = []
-        selection_counter = 0
-        selected_items_quotient_sum = 0
-        num_of_items = 0
-        item1 = ""
-        item1_prob = 0
-        item2_prob = 0
-        voters = 0
-        voted_items = []
-        selected_probabilities = []
-        initial_team = ""
-
-        # initialize trajectory, action sequence and key
-        trajectory = [0]  # initialize with start state
-        event_sequence = ["start_game"]
-        key = ""
+    # initialize the graph of the file
+    graph = context.single_graph = Graph()
+
+    if FOCUS == "single_players":
+        process_single_players(context, data_file, csv_reader)
+    elif FOCUS == "teams":
+        # teams are found while streaming the rows (each team starts with a filename cell containing FILE_SEPARATOR),
+        # so the file is read in a single pass and no pre-scan with find_teams() is needed
+
+        machine = None
 
         for row in csv_reader:
 
             first_cell = row[TEAM_ID_COLUMN]
-            if first_cell in TEAMS:
+            if first_cell.find(FILE_SEPARATOR) > -1:
                 team = first_cell
-                if team != initial_team:
+                if machine is None or team != machine.team:
 
                     # a new team has been found: process it
-                    global PROCESS_CURRENT_TEAM
-                    PROCESS_CURRENT_TEAM = True
-
-                    # print("---starting to process new team: " + team)
-
-                    # use row_counter to count the lines of each team's file, because it's easier to debug single files
-                    row_counter = 1
+                    context.teams.append(team)
 
                     # ------ close previous team's states, trajectories and links
-                    if initial_team != "":
-                        if initial_team in SINGLE_GRAPH.states[0]['user_ids']:
-                            SINGLE_GRAPH.close_graph(trajectory, initial_team, event_sequence, key)
-                        # else:
-                        # print ("---------------- found useless team: " + initial_team)
-                        # increase the count of targets
-                        global TARGET_COUNT
-                        TARGET_COUNT = TARGET_COUNT + 1
+                    if machine is not None:
+                        # increase the count of targets, unless the team has already been closed at its END row
+                        # or has no actual state
+                        if machine.close():
+                            context.target_count = context.target_count + 1
                         # clear the mining tools and mines
-                        MINING_TOOLS.clear()
-                        MINES.clear()
+                        context.clear_items()
 
                         # temporary
-                        # print_risk_sequences(selected_probabilities)
-
-                    # reinitialize variables
-                    gold_counter = 0
-                    round_counter = 1
-                    items_selected = []
-                    selection_counter = 0
-                    selected_items_quotient_sum = 0
-                    num_of_items = 0
-                    item1 = ""
-                    item1_prob = 0
-                    item2_prob = 0
-                    voted_items = []
-                    voters = 0
-                    selected_probabilities = []
-
-                    # reinitialize trajectory, action sequence and key
-                    trajectory = [0]  # initialize with start state
-                    event_sequence = ["start_game"]
-                    key = ""
-
-                    # update initial team
-                    initial_team = team
-
-            event = row[EVENT_COLUMN]
-            row_counter = row_counter + 1
-
-            # make sure the current team can be processed because it has not yet reached "GameSuspended"
-            global PROCESS_CURRENT_TEAM
-            if PROCESS_CURRENT_TEAM:
-
-                if event == "ItemSetup":
-                    MINING_TOOLS[row[ITEM_COLUMN]] = row[ITEM_PROBABILITY_COLUMN]
-                    # print ("MINING_TOOLS: " + str(MINING_TOOLS))
-                elif event == "MineSetup":
-                    prob_string = row[ITEM_PROBABILITY_COLUMN]
-                    # mines have a min and max probability of success: we store their average in MINING_TOOLS
-                    prob_list = prob_string.translate(None, '()').split()
-                    floor = float(prob_list[0])
-                    ceiling = float(prob_list[1])
-                    MINES[row[ITEM_COLUMN]] = [floor, ceiling]
-                    # MINING_TOOLS[row[ITEM_COLUMN]] = (floor + ceiling)/2
-                    # print("MINES: " + str(MINES))
-
-                # if the event is different from the team name,
-                # append it to the key that distinguishes sequence graph nodes (i.e. players or teams)
-                # and to the sequence of actions, and pick the mining tool if it's in the event
-                if event != team:
-                    key += ('_' + event)
-                    # append the event here (NOT when specific events happen, otherwise only those events are appended)
-                    event_sequence.append(event)
-
-                if event == "StartVotation":
-
-                    # print ("StartVotation - file: " + team + "  line: " + str(row_counter))
-                    item1 = row[START_VOTATION_COLUMN_1]
-                    item2 = row[START_VOTATION_COLUMN_2]
-
-                    if item1.find("Mine") > -1:
-                        item1_prob = MINES[item1][0]
-                    else:
-                        item1_prob = float(MINING_TOOLS[item1])
-
-                    if item2.find("Mine") > -1:
-                        item2_prob = MINES[item2][0]
-                    else:
-                        item2_prob = float(MINING_TOOLS[item2])
-
-                    # mining_tools_prob_sum = item1_prob + item2_prob  # sum of success probs. of mining tools to choose from
-
-                    # print("--- items to choose from: " +
-                    #       item1 + " (" + str(item1_prob) + ")" + ", " +
-                    #       item2 + " (" + str(item2_prob) + ")"
-                    #       # + " - sum of probabilities: " + str(mining_tools_prob_sum)
-                    #       )
-
-                if event == "Vote":
-                    item = row[ITEM_VOTED_COLUMN]
-                    if item in MINING_TOOLS:
-                        item_prob_of_success = MINING_TOOLS[item]
-                        voted_items.append(float(item_prob_of_success))
-                        voters = voters + 1
-                        # print("-------------- voted item: " + item + " (" + str(item_prob_of_success) + ")")
-
-                if event == "LeaderSelection":
-
-                    # compute st_dev of votes and create a state based on it
-                    if "voting_st_dev" in EVENTS_TO_PROCESS and voted_items.__len__() > 1:
-                        st_dev = statistics.stdev(voted_items)
-                        if st_dev == 0:
-                            st_dev_bin = "None"
-                        elif 0 < st_dev <= 0.35:
-                            st_dev_bin = "Small"
-                        elif st_dev > 0.35:
-                            st_dev_bin = "Large"
-                        # print("...... voted_items: " + str(voted_items))
-                        # print("...... st_dev of voted items: " + str(st_dev) + " -- bin: " + st_dev_bin)
-                        # print("...... added state based on st_dev_bin")
-
-                        # add the round+risk event
-                        if SIMPLE_STATE_CRITERION:
-                            # print (">>> team: " + team + " round: " + str(round_counter) + " selected_probabilities: " + str(selected_probabilities))
-                            event_to_add = "st_dev r" + str(round_counter) + ": " + str(st_dev_bin) + " voters: " + str(voters)
-                            # print("event_to_add: " + event_to_add)
-                            SINGLE_GRAPH.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-                        # TODO: uncomment and massage next lines
-                        # else:
-                        # add_event("st_dev", st_dev_bin, team, trajectory, None, None, None)
-
-                    # reset votes and voters
-                    voted_items = []
-                    voters = 0
-
-                    item = row[ITEM_SELECTED_COLUMN]
-                    items_selected.append(item)
-                    # print("item selected: " + item)
-                    if item in MINING_TOOLS or item in MINES:
-
-                        # print("... diff between risks: " + str(abs(item1_prob - item2_prob)))
-
-                        difference_between_risks = float(abs(item1_prob - item2_prob))
-
-                        if item1_prob == item2_prob:
-                            risk = "n.a."
-                            # print(".......... team: " + team + " RISK DIFFERENCE: NONE!")
-                        elif difference_between_risks <= 0.1001:
-                            risk = "negligible"
-                            # print (".......... team: " + team + " RISK DIFFERENCE <= 0.1!")
-                        elif item == item1 and item1_prob < item2_prob:
-                            risk = "high"
-                        else:
-                            risk = "low"
-                        selected_probabilities.append(risk)
-                        # print("-------------- difference between risks: " + str(float(abs(item1_prob - item2_prob))))
-                        # print("item1_prob: " + str(item1_prob) + ", " "item2_prob: " + str(item2_prob))
-
-                        risk_proneness = ""
-                        if risk == "high":
-                            if difference_between_risks <= 0.3001:
-                                risk_proneness = "low"
-                            elif 0.3001 < difference_between_risks < 0.6001:
-                                risk_proneness = "medium"
-                            elif difference_between_risks >= 0.6001:
-                                risk_proneness = "high"
-
-                            if "risk_proneness" in EVENTS_TO_PROCESS and risk_proneness != "":
-                                if SIMPLE_STATE_CRITERION:
-                                    event_to_add = "risk_proneness" + ": " + risk_proneness
-                                    # print (event_to_add)
-                                    SINGLE_GRAPH.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-
-                        if "risk" in EVENTS_TO_PROCESS and risk != "":
-                            if SIMPLE_STATE_CRITERION:
-                                event_to_add = "r" + str(round_counter) + ":" + "risk " + risk
-                                SINGLE_GRAPH.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-                            # TODO: uncomment and massage next lines
-                            # else:
-                                #add_event("risk", risk, team, trajectory, None, items_selected, risk)
-                                # print("_______ added risk event: " + team + " risk: " + risk)
-
-                if "gold" in EVENTS_TO_PROCESS and event == "TotalGold":
-                    gold_counter = process_gold(row, TOTAL_GOLD_COLUMN, False, gold_counter, team, trajectory,
-                                                event_sequence)
-
-                if event == ROUND_SEPARATOR:
-                    if round_counter >= 1:
-                        avg_selected_item_success_prob = 0
-                        risk_aversion = ""
-
-                        if num_of_items > 0:
-                            # compute the average quotient and then reset its components
-                            avg_selected_item_success_prob = round(
-                                float(selected_items_quotient_sum) / selection_counter, 2)
-                            num_of_items = 0
-                            selected_items_quotient_sum = 0
-                            selection_counter = 0
-                            # select the risk aversion category
-                            if avg_selected_item_success_prob <= RISK_THRESHOLD_LOW:
-                                risk_aversion = "low"
-                            elif RISK_THRESHOLD_LOW < avg_selected_item_success_prob <= RISK_THRESHOLD_MEDIUM:
-                                risk_aversion = "medium"
-                            else:
-                                risk_aversion = "high"
-
-                        # add the risk aversion event
-                        # TODO: uncomment and massage next lines
-                        # if "risk_aversion" in EVENTS_TO_PROCESS and risk_aversion != "":
-                             # add_event("risk_aversion", risk_aversion, team, trajectory, None, items_selected, str(avg_selected_item_success_prob))
-
-                        # add the round event and avoid updating action sequence because rounds are not team's actions
-                        if "round" in EVENTS_TO_PROCESS:
-                            if SIMPLE_STATE_CRITERION:
-                                event_to_add = "round " + str(round_counter)
-                                SINGLE_GRAPH.add_event_string_based(event_to_add, "round", team, trajectory, None)
-                            # TODO: uncomment and massage next lines
-                            # else:
-                                #add_event("round", round_counter, team, trajectory, None, items_selected, risk_aversion)
-                                # print("added round event num: " + str(round_counter))
-                                # print(">>>>>>>>>> avg_selected_item_success_prob: " + str(avg_selected_item_success_prob))
-                                # print(">>>>>>>>>> risk_aversion: " + risk_aversion)
-
-                        # add the round+risk event
-                        if "round+risk" in EVENTS_TO_PROCESS and selected_probabilities.__len__() > 0:
-                            if SIMPLE_STATE_CRITERION:
-                                # print (">>> team: " + team + " round: " + str(round_counter) + " selected_probabilities: " + str(selected_probabilities))
-
-                                event_to_add = "round+risk" + str(round_counter) + ": " + str(selected_probabilities)
-                                SINGLE_GRAPH.add_event_string_based(event_to_add, "round", team, trajectory, None)
-                                # print("...... team: " + team + " round counter: " + str(round_counter) + " selected probs.: " + str(selected_probabilities))
-                                # reset the list of selected probabilities
-                                selected_probabilities = []
-
-                    round_counter = round_counter + 1
-
-                    items_selected = []
-
-            # if the game is suspended, stop processing the current team until a new team is found in the file
-            if first_cell == "GameSuspended":
-                global PROCESS_CURRENT_TEAM
-                PROCESS_CURRENT_TEAM = False
-                # print ("!!!!!!!!!!!! Team: " + team + " has GameSuspended!")
+                        # print_risk_sequences(machine.round_aggregates.risks)
 
-                # temporary
-                # print_risk_sequences(selected_probabilities)
+                    machine = TeamSessionMachine(context, team, graph, concatenated=True)
+
+                # team names are not events, so they are not added to the event vocabulary
+                continue
+
+            # skip the rows preceding the first team
+            if machine is None:
+                continue
+
+            # once the game is suspended, the rows are skipped until a new team is found in the file
+            machine.feed(row)
 
             # if it's end of file, close the graph of the current team if
             # it's in the START state (which means the team is in at least 1 actual state)
-            if first_cell == "END" and team in TEAMS and team in SINGLE_GRAPH.states[0]['user_ids']:
-                SINGLE_GRAPH.close_graph(trajectory, team, event_sequence, key)
-                # increase the count of targets
-                global TARGET_COUNT
-                TARGET_COUNT = TARGET_COUNT + 1
+            if first_cell == "END" and graph.has_target(0, machine.team):
+                # increase the count of targets, unless the team has already been closed
+                if machine.close():
+                    context.target_count = context.target_count + 1
                 # clear the mining tools and mines
-                MINING_TOOLS.clear()
-                MINES.clear()
+                context.clear_items()
 
                 # temporary
-                # print_risk_sequences(selected_probabilities)
+                # print_risk_sequences(machine.round_aggregates.risks)
 
     # ------ RETURN RESULTS
-    # generate lists from dictionaries
-    state_list = list(SINGLE_GRAPH.states.values())
-    link_list = list(SINGLE_GRAPH.links.values())
-    trajectory_list = list(SINGLE_GRAPH.trajectories.values())
-
-    # compute similarities among trajectories (possibly on the basis of simple criteria)
-    # ------ FOR JIMMY: next line can be commented and replaced with a call to your function
-    # Jimmy test
-    # TODO: uncomment and massage next line
-    # traj_similarity = compute_similarities()
-
-    # return the results
-    return {'level_info': 'Visualization',
-            'num_patterns': TARGET_COUNT,
-            'num_users': TARGET_COUNT,
-            'nodes': state_list,
-            'links': link_list,
-            'trajectories': trajectory_list,
-            # TODO: massage next line
-            'traj_similarity': [], # traj_similarity,
-            'setting': 'test'}
+    graph.target_count = context.target_count
+    return visualization_document(graph)
 
 
-def parse_team_data_onto_multiple_json_files(csv_reader, team):
+def parse_team_data_onto_multiple_json_files(context, csv_reader, team):
     """
     parse csv data to create node, link and trajectory
+    :param context: the processing context
     :param csv_reader: raw csv data
     :param team: filename
     :return:
     """
 
     # increase the count of teams
-    global TARGET_COUNT
-    TARGET_COUNT = TARGET_COUNT + 1
+    context.target_count = context.target_count + 1
 
-    # initialize a new graph
-    graph = Graph()
+    graph = parse_team_graph(context, csv_reader, team)
+
+    return store_visualization(context, graph)
+
+
+def parse_team_graph(context, csv_reader, team):
+    """
+    parse the csv data of a team onto the graph of its experimental condition
+    :param context: the processing context, holding the graphs of the experimental conditions
+    :param csv_reader: raw csv data
+    :param team: filename
+    :return: the graph the team has been added to, indexed by experimental condition
+    """
 
     # clear mining tools and mines
-    # TODO: transform these global vars into local ones
-    MINING_TOOLS.clear()
-    MINES.clear()
+    context.clear_items()
 
-    # initialize variables
-    exp_cond = ""
-    gold_counter = 0
-    round_counter = 1
-    items_selected = []
-    selection_counter = 0
-    selected_items_quotient_sum = 0
-    num_of_items = 0
-    item1 = ""
-    item1_prob = 0
-    item2_prob = 0
-    voters = 0
-    voted_items = []
-    selected_probabilities = []
-    process_current_team = True
-
-    # initialize trajectory, action sequence and key
-    trajectory = [0]  # initialize with start state
-    event_sequence = ["start_game"]
-    key = ""
+    # the graph is replaced by the graph of the experimental condition when the match setup is found
+    machine = TeamSessionMachine(context, team, Graph(), per_condition=True)
+    machine.feed_rows(csv_reader)
 
-    for row in csv_reader:
-        # use row_counter to count the lines of each team's file, because it's easier to debug single files
-        row_counter = 1
-
-        event = row[EVENT_COLUMN]
-        row_counter = row_counter + 1
-
-        # if the game is suspended, output signal to stop processing the current team
-        if event == "GameSuspended":
-            process_current_team = False
-            # print ("!!!!!!!!!!!! Team: " + team + " has GameSuspended!")
-
-            # temporary
-            # print_risk_sequences(selected_probabilities)
-
-        # make sure the current team can be processed because it has not yet reached "GameSuspended"
-        if process_current_team:
-
-            if event == "SetupMatch":
-                exp_cond = "Competition" + row[COMPETITION_LEVEL_COLUMN]
-                if exp_cond not in GRAPHS:
-                    # add the new graph initialized above to the dictionary of experimental conditions
-                    GRAPHS[exp_cond] = graph
-                else:
-                    # get the graph corresponding to the current experimental condition
-                    graph = GRAPHS[exp_cond]
-
-            if event == "ItemSetup":
-                MINING_TOOLS[row[ITEM_COLUMN]] = row[ITEM_PROBABILITY_COLUMN]
-                # print ("MINING_TOOLS: " + str(MINING_TOOLS))
-            elif event == "MineSetup":
-                prob_string = row[ITEM_PROBABILITY_COLUMN]
-                # mines have a min and max probability of success: we store their average in MINING_TOOLS
-                prob_list = prob_string.translate(None, '()').split()
-                floor = float(prob_list[0])
-                ceiling = float(prob_list[1])
-                MINES[row[ITEM_COLUMN]] = [floor, ceiling]
-                # MINING_TOOLS[row[ITEM_COLUMN]] = (floor + ceiling)/2
-                # print("MINES: " + str(MINES))
-
-            # append the event to the key that distinguishes sequence graph nodes (i.e. players or teams)
-            # and to the sequence of actions, and pick the mining tool if it's in the event
-            key += ('_' + event)
-            # append the event here (NOT when specific events happen, otherwise only those events are appended)
-            event_sequence.append(event)
-
-            if event == "StartVotation":
-
-                # print ("StartVotation - file: " + team + "  line: " + str(row_counter))
-                item1 = row[START_VOTATION_COLUMN_1]
-                item2 = row[START_VOTATION_COLUMN_2]
-
-                if item1.find("Mine") > -1:
-                    item1_prob = MINES[item1][0]
-                else:
-                    item1_prob = float(MINING_TOOLS[item1])
-
-                if item2.find("Mine") > -1:
-                    item2_prob = MINES[item2][0]
-                else:
-                    item2_prob = float(MINING_TOOLS[item2])
-
-                # mining_tools_prob_sum = item1_prob + item2_prob  # sum of success probs. of mining tools to choose from
-
-                # print("--- items to choose from: " +
-                #       item1 + " (" + str(item1_prob) + ")" + ", " +
-                #       item2 + " (" + str(item2_prob) + ")"
-                #       # + " - sum of probabilities: " + str(mining_tools_prob_sum)
-                #       )
-
-            if event == "Vote":
-                item = row[ITEM_VOTED_COLUMN]
-                if item in MINING_TOOLS:
-                    item_prob_of_success = MINING_TOOLS[item]
-                    voted_items.append(float(item_prob_of_success))
-                    voters = voters + 1
-                    # print("-------------- voted item: " + item + " (" + str(item_prob_of_success) + ")")
-
-            if event == "LeaderSelection":
-
-                # compute st_dev of votes and create a state based on it
-                if "voting_st_dev" in EVENTS_TO_PROCESS and voted_items.__len__() > 1:
-                    st_dev = statistics.stdev(voted_items)
-                    if st_dev == 0:
-                        st_dev_bin = "None"
-                    elif 0 < st_dev <= 0.35:
-                        st_dev_bin = "Small"
-                    elif st_dev > 0.35:
-                        st_dev_bin = "Large"
-                    # print("...... voted_items: " + str(voted_items))
-                    # print("...... st_dev of voted items: " + str(st_dev) + " -- bin: " + st_dev_bin)
-                    # print("...... added state based on st_dev_bin")
-
-                    # add the round+risk event
-                    if SIMPLE_STATE_CRITERION:
-                        # print (">>> team: " + team + " round: " + str(round_counter) + " selected_probabilities: " + str(selected_probabilities))
-                        event_to_add = "st_dev r" + str(round_counter) + ": " + str(st_dev_bin) + " voters: " + str(voters)
-                        # print("event_to_add: " + event_to_add)
-                        graph.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-                    # TODO: uncomment and massage next lines
-                    # else:
-                    #     add_event("st_dev", st_dev_bin, team, trajectory, None, None, None)
-
-                # reset votes and voters
-                voted_items = []
-                voters = 0
-
-                item = row[ITEM_SELECTED_COLUMN]
-                items_selected.append(item)
-                # print("item selected: " + item)
-                if item in MINING_TOOLS or item in MINES:
-
-                    # print("... diff between risks: " + str(abs(item1_prob - item2_prob)))
-
-                    difference_between_risks = float(abs(item1_prob - item2_prob))
-
-                    if item1_prob == item2_prob:
-                        risk = "n.a."
-                        # print(".......... team: " + team + " RISK DIFFERENCE: NONE!")
-                    elif difference_between_risks <= 0.1001:
-                        risk = "negligible"
-                        # print (".......... team: " + team + " RISK DIFFERENCE <= 0.1!")
-                    elif item == item1 and item1_prob < item2_prob:
-                        risk = "high"
-                    else:
-                        risk = "low"
-                    selected_probabilities.append(risk)
-                    # print("-------------- difference between risks: " + str(float(abs(item1_prob - item2_prob))))
-                    # print("item1_prob: " + str(item1_prob) + ", " "item2_prob: " + str(item2_prob))
-
-                    risk_proneness = ""
-                    if risk == "high":
-                        if difference_between_risks <= 0.3001:
-                            risk_proneness = "low"
-                        elif 0.3001 < difference_between_risks < 0.6001:
-                            risk_proneness = "medium"
-                        elif difference_between_risks >= 0.6001:
-                            risk_proneness = "high"
-
-                        if "risk_proneness" in EVENTS_TO_PROCESS and risk_proneness != "":
-                            if SIMPLE_STATE_CRITERION:
-                                event_to_add = "risk_proneness" + ": " + risk_proneness
-                                # print (event_to_add)
-                                graph.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-
-                    if "risk" in EVENTS_TO_PROCESS and risk != "":
-                        if SIMPLE_STATE_CRITERION:
-                            event_to_add = "r" + str(round_counter) + ":" + "risk " + risk
-                            graph.add_event_string_based(event_to_add, "mid", team, trajectory, None)
-                        # TODO: uncomment and massage next line
-                        # else:
-                            # add_event("risk", risk, team, trajectory, None, items_selected, risk)
-                            # print("_______ added risk event: " + team + " risk: " + risk)
-
-            if "gold" in EVENTS_TO_PROCESS and event == "TotalGold":
-                gold_counter = process_gold(row, TOTAL_GOLD_COLUMN, False, gold_counter, team, trajectory,
-                                            event_sequence)
-
-            if event == ROUND_SEPARATOR:
-                if round_counter >= 1:
-                    avg_selected_item_success_prob = 0
-                    risk_aversion = ""
-
-                    if num_of_items > 0:
-                        # compute the average quotient and then reset its components
-                        avg_selected_item_success_prob = round(
-                            float(selected_items_quotient_sum) / selection_counter, 2)
-                        num_of_items = 0
-                        selected_items_quotient_sum = 0
-                        selection_counter = 0
-                        # select the risk aversion category
-                        if avg_selected_item_success_prob <= RISK_THRESHOLD_LOW:
-                            risk_aversion = "low"
-                        elif RISK_THRESHOLD_LOW < avg_selected_item_success_prob <= RISK_THRESHOLD_MEDIUM:
-                            risk_aversion = "medium"
-                        else:
-                            risk_aversion = "high"
-
-                    # add the risk aversion event
-                    # TODO: uncomment and massage next lines
-                    # if "risk_aversion" in EVENTS_TO_PROCESS and risk_aversion != "":
-                    #     add_event("risk_aversion", risk_aversion, team, trajectory, None, items_selected,
-                    #               str(avg_selected_item_success_prob))
-
-                    # add the round event and avoid updating action sequence because rounds are not team's actions
-                    if "round" in EVENTS_TO_PROCESS:
-                        if SIMPLE_STATE_CRITERION:
-                            event_to_add = "round " + str(round_counter)
-                            graph.add_event_string_based(event_to_add, "round", team, trajectory, None)
-                        # TODO: uncomment and massage next line
-                        # else:
-                        #     add_event("round", round_counter, team, trajectory, None, items_selected, risk_aversion)
-                            # print("added round event num: " + str(round_counter))
-                            # print(">>>>>>>>>> avg_selected_item_success_prob: " + str(avg_selected_item_success_prob))
-                            # print(">>>>>>>>>> risk_aversion: " + risk_aversion)
-
-                    # add the round+risk event
-                    if "round+risk" in EVENTS_TO_PROCESS and selected_probabilities.__len__() > 0:
-                        if SIMPLE_STATE_CRITERION:
-                            # print (">>> team: " + team + " round: " + str(round_counter) + " selected_probabilities: " + str(selected_probabilities))
-
-                            event_to_add = "round+risk" + str(round_counter) + ": " + str(selected_probabilities)
-                            graph.add_event_string_based(event_to_add, "round", team, trajectory, None)
-                            # print("...... team: " + team + " round counter: " + str(round_counter) + " selected probs.: " + str(selected_probabilities))
-                            # reset the list of selected probabilities
-                            selected_probabilities = []
-
-                round_counter = round_counter + 1
-                items_selected = []
-
-    # if it's end of file, close the graph of the current team if
-    # it's in the START state (which means the team is in at least 1 actual state)
-    if team in graph.states[0]['user_ids']:
-        graph.close_graph(trajectory, team, event_sequence, key)
+    # if it's end of file, close the graph of the current team
+    machine.close()
+    graph = machine.graph
 
     # temporary
-    # print_risk_sequences(selected_probabilities)
+    # print_risk_sequences(machine.round_aggregates.risks)
 
-    # ------ RETURN RESULTS
-    # generate lists from dictionaries
-    state_list = list(graph.states.values())
-    link_list = list(graph.links.values())
-    trajectory_list = list(graph.trajectories.values())
-
-    # compute similarities among trajectories (possibly on the basis of simple criteria)
-    # ------ FOR JIMMY: next line can be commented and replaced with a call to your function
-    # Jimmy test
-    # TODO: uncomment and massage next line
-    # traj_similarity = compute_similarities()
-
-    # store the results
-    visualization = {
-         'level_info': 'Visualization',
-            'num_patterns': TARGET_COUNT,
-            'num_users': TARGET_COUNT,
-            'nodes': state_list,
-            'links': link_list,
-            'trajectories': trajectory_list,
-            # TODO: massage next line
-            'traj_similarity': [],  # traj_similarity,
-            'setting': 'test'}
-    VISUALIZATIONS[exp_cond] = visualization
+    graph.index = machine.exp_cond
+    return graph
 
-    # return the results
+
+def store_visualization(context, graph):
+    """
+    store a graph in the visualizations of the context, indexed by its experimental condition, with the current count
+    of targets
+    :param context: the processing context
+    :param graph: the graph of an experimental condition
+    :return: the graph
+    """
+    graph.target_count = context.target_count
+    context.visualizations[graph.index] = graph
+    return graph
+
+
+def visualization_document(graph):
+    """
+    get the visualization of a graph in the json structure read by glyph: nodes, links and trajectories are iterated
+    straight from the graph, so that they are written to the json file without being copied into lists
+    :param graph: the graph to visualize
+    :return:
+    """
     return {'level_info': 'Visualization',
-            'num_patterns': TARGET_COUNT,
-            'num_users': TARGET_COUNT,
-            'nodes': state_list,
-            'links': link_list,
-            'trajectories': trajectory_list,
-            # TODO: massage next line
-            'traj_similarity': [], # traj_similarity,
+            'num_patterns': graph.target_count,
+            'num_users': graph.target_count,
+            'nodes': graph.states.itervalues(),
+            'links': graph.links.itervalues(),
+            'trajectories': (export_trajectory(value, graph.event_names) for value in graph.trajectories.itervalues()),
+            # compute similarities among trajectories (possibly on the basis of simple criteria)
+            'traj_similarity': compute_similarities(graph.trajectories.values(), graph.event_names),
             'setting': 'test'}
 
 
+def write_output(context, out_folder, output_file, document, graph=None):
+    """
+    write a file for glyph with SERIALIZER, compressed if COMPRESS_OUTPUT is True, and with its precompressed variants
+    if PRECOMPRESS_OUTPUT is True; a file whose content did not change is not rewritten;
+    the file is added to the output manifest of the context
+    :param context: the processing context
+    :param out_folder: output folder
+    :param output_file: name of the output file, without extension
+    :param document: the document to write
+    :param graph: the graph the document visualizes, whose nodes, links and trajectories are counted in the manifest
+    :return:
+    """
+    serializer = output_files.get_serializer(SERIALIZER)
+    filename = output_file + serializer.extension + ('.gz' if COMPRESS_OUTPUT else '')
+    output = output_files.write_document(out_folder + filename, document, serializer, COMPRESS_OUTPUT)
+
+    entry = {'file': filename, 'size': output.size, 'hash': output.hash}
+    if graph is not None:
+        entry['nodes'] = len(graph.states)
+        entry['links'] = len(graph.links)
+        entry['trajectories'] = len(graph.trajectories)
+    if PRECOMPRESS_OUTPUT:
+        entry['compressed'] = output_files.write_compressed_variants(out_folder + filename, output.changed)
+    context.output_manifest[output_file] = entry
+
+
 def print_risk_sequences(selected_probabilities):
     if selected_probabilities.__len__() > 0:
         for prob in selected_probabilities:
@@ -1126,79 +1491,183 @@ def print_risk_sequences(selected_probabilities):
         print()
 
 
-def compute_similarities():
-    # compute distances between trajectories
-    similarity_criterium = "GoldSetup"
-    traj_similarity = []
-    similarity_id = 0
-    similarity_threshold = 6
-    # skipped_traj_ids stores the trajectories that are too close to some trajectories
-    # thus need not be recomputed
-    skipped_traj_ids = []
-
-    for i in range(len(TRAJECTORIES) - 1):
+def compute_similarities(trajectories, event_names):
+    """
+    compute the similarities among trajectories with SIMILARITY_METRIC:
+    "counts" compares the number of rounds (GoldSetup events) of the trajectories, using count vectors of the events;
+    a trajectory closer than the threshold to a previous one is not compared with the following ones;
+    "edit" links each trajectory to its nearest neighbours by the normalized edit distance of their state sequences;
+    "minhash" approximates "edit", scoring only the candidate neighbours found by a minhash lsh index
+    :param trajectories: the trajectories of a graph, in the order they are exported
+    :param event_names: the event vocabulary the action meanings have been encoded with
+    :return: list of the similarities, or an empty list if SIMILARITY_METRIC is None
+    """
+    if SIMILARITY_METRIC is None:
+        return []
+    if similarity is None:
+        raise ImportError("the similarities among trajectories need numpy")
 
-        if i not in skipped_traj_ids:
+    if SIMILARITY_METRIC == "edit":
+        return similarity.edit_similarities([trajectory['trajectory'] for trajectory in trajectories],
+                                            workers=SIMILARITY_WORKERS)
+    if SIMILARITY_METRIC == "minhash":
+        return similarity.minhash_similarities([trajectory['trajectory'] for trajectory in trajectories])
 
-            for j in range(i + 1, len(TRAJECTORIES)):
+    features = similarity.count_features([trajectory['action_meaning'] for trajectory in trajectories],
+                                         len(event_names))
+    columns = [event_names.index(event) for event in similarity.SIMILARITY_CRITERION]
+    return similarity.count_similarities(features, columns, similarity.SIMILARITY_THRESHOLD)
 
-                quantity_i = TRAJECTORIES.values()[i]['action_meaning'].count(similarity_criterium)
-                quantity_j = TRAJECTORIES.values()[j]['action_meaning'].count(similarity_criterium)
-                sim = abs(quantity_i - quantity_j)
 
-                # print("...... quantity_i: " + str(quantity_i))
-                # print("...... quantity_j: " + str(quantity_j))
-                # print("...... diff: " + str(sim))
-                #
-                # print("...... similarity: " + str(sim))
+def read_rows(context, data_file, concatenated=False):
+    """
+    read the rows of a raw data file from its columnar event cache if EVENT_CACHE_FOLDER is set
+    (building the cache the first time), otherwise parse them with the csv reader;
+    if the context has a round window, only the rows of the rounds in the window (and the setup of each team) are read
+    :param context: the processing context
+    :param data_file: input file
+    :param concatenated: True if the file contains the rows of several teams, each starting with the team name
+    :return: iterable of the rows
+    """
+    cache = None
+    if EVENT_CACHE_FOLDER is not None:
+        if event_cache is None:
+            raise ImportError("the event cache needs numpy")
+        cache = event_cache.load_event_cache(data_file.name, EVENT_CACHE_FOLDER)
+    if context.round_window is not None and FOCUS == "teams":
+        return read_round_window(context, data_file.name, cache, concatenated)
+    if cache is not None:
+        return event_cache.CachedRows(cache)
+    return csv.reader(data_file)
+
+
+def first_round(context):
+    """
+    :param context: the processing context
+    :return: number of the first round parsed for each team
+    """
+    return context.round_window[0] if context.round_window is not None else 1
 
-                traj_similarity.append({'id': str(similarity_id),
-                                        'source': i,
-                                        'target': j,
-                                        'similarity': sim
-                                        })
 
-                # print("...... traj_similarity[similarity_id]: " + str(traj_similarity[similarity_id]))
-                similarity_id += 1
+def round_window_segments(markers, start, limit, round_window):
+    """
+    find the parts of a team's rows to read for a round window: the setup rows before the first round (only when the
+    window does not start with it), the rows of the rounds in the window, and the END row of the team, which is read
+    even if the team has no round in the window;
+    the rows of a round end with its ROUND_SEPARATOR row, as in the parsers; positions are [byte offset, row number]
+    :param markers: markers of the file (see check_rounds.scan_markers)
+    :param start: position of the first row of the team
+    :param limit: position of the first row after the team, or None if the team ends with the file
+    :param round_window: (first, last) rounds to read (see ROUND_WINDOW)
+    :return: list of the segments to read, as (first position, whether to skip the first row, stop position,
+    whether only the setup rows are read); a stop position is excluded, and None stands for the end of the file
+    """
+    def in_team(position):
+        return position[0] >= start[0] and (limit is None or position[0] < limit[0])
+
+    first, last = round_window
+    separators = [position for position in markers[ROUND_SEPARATOR] if in_team(position)]
+    suspensions = [position for position in markers["GameSuspended"] if in_team(position)]
+    ends = [position for position in markers["END"] if in_team(position)]
+
+    segments = []
+    window = (start, False)
+    if first > 1:
+        # the context of the team is rebuilt from its setup, read up to the first round
+        segments.append((start, False, separators[0] if separators else limit, True))
+        if len(separators) < first - 1:
+            # the team has no round in the window
+            window = None
+        elif suspensions and suspensions[0][0] < separators[first - 2][0]:
+            # the game is suspended before the window
+            window = None
+        else:
+            # the window starts after the ROUND_SEPARATOR row ending the round before it
+            window = (separators[first - 2], True)
+
+    window_stop = limit
+    if window is not None:
+        if len(separators) >= last:
+            # stop right after the ROUND_SEPARATOR row ending the last round of the window
+            window_stop = [separators[last - 1][0] + 1, separators[last - 1][1] + 1]
+        segments.append((window[0], window[1], window_stop, False))
+    if ends and (window is None or window_stop != limit):
+        # the END row is not in the rows of the window
+        segments.append((ends[0], False, limit, False))
+    return segments
+
+
+def read_round_window(context, path, cache=None, concatenated=False):
+    """
+    read the rows of the rounds of the round window of the context, seeking them with the index of the round markers
+    of the file (see check_rounds.py), so that the rows outside the window are not read at all
+    :param context: the processing context
+    :param path: path of the raw data file
+    :param cache: the columnar event cache of the file, to read the rows from (optional)
+    :param concatenated: True if the file contains the rows of several teams, each starting with the team name
+    :return: generator of the rows
+    """
+    markers = context.file_markers(path)
 
-                if sim < similarity_threshold and j not in skipped_traj_ids:
-                    # print "------------ Skipping: %d" % j
-                    skipped_traj_ids.append(j)
-    return traj_similarity
+    if concatenated:
+        # the rows preceding the first team are skipped by the parser, so they are not read
+        starts = markers[check_rounds.TEAM_MARKER]
+        teams = [(starts[i], starts[i + 1] if i + 1 < len(starts) else None) for i in range(len(starts))]
+    else:
+        teams = [([0, 0], None)]
+
+    for start, limit in teams:
+        for segment_start, skip, segment_stop, setup_only in round_window_segments(markers, start, limit,
+                                                                                   context.round_window):
+            if cache is not None:
+                rows = cache.rows(segment_start[1] + (1 if skip else 0),
+                                  segment_stop[1] if segment_stop is not None else None)
+            else:
+                rows = check_rounds.read_rows_at(path, segment_start[0], segment_stop[0] if segment_stop else None)
+                if skip:
+                    next(rows, None)
+            for row in rows:
+                if not setup_only or row[EVENT_COLUMN] in SETUP_EVENTS or row[EVENT_COLUMN].find(FILE_SEPARATOR) > -1:
+                    yield row
 
 
-def find_players(csv_reader):
+def find_players(context, csv_reader):
     """
     finds the player names in the csv file
+    :param context: the processing context
     :param csv_reader: input file
     :return:
     """
     for row in csv_reader:
         if row[EVENT_COLUMN] == "PlayerConnection":
-            PLAYERS.append(row[PLAYER_ID_COLUMN])
+            context.players.append(row[PLAYER_ID_COLUMN])
 
 
-def find_teams(csv_reader):
+def find_teams(context, csv_reader):
     """
     finds the teams in the csv file
+    :param context: the processing context
     :param csv_reader: input file
     :return:
     """
     for row in csv_reader:
         team = row[TEAM_ID_COLUMN]
         if team.find(FILE_SEPARATOR) > -1:
-            TEAMS.append(team)
+            context.teams.append(team)
 
 
-def process_data(input_folder, out_folder, action_from_file=True):
+def process_data(input_folder, out_folder, action_from_file=True, context=None):
     """
     process each csv file to create the json file for glyph
     :param input_folder: folder containing raw data files
     :param out_folder: output folder
     :param action_from_file: if True then finds the actions names from the file; if False then the actions should be
     manually set in the game_actions variable in main
-    :return:
+    :param context: the processing context of the analysis (default: a new one)
+    :return: the processing context
     """
+    if context is None:
+        context = ProcessingContext()
 
     for subdir, dirs, files in os.walk(input_folder):
         ind = 0
@@ -1214,34 +1683,261 @@ def process_data(input_folder, out_folder, action_from_file=True):
 
             if ext == 'csv':
                 print(ind, ":", output_file)
-                FILE_NAMES_LIST.append(output_file)
+                context.file_names.append(output_file)
 
                 with open(input_folder + filename, 'rU') as data_file:
-                    csv_reader = csv.reader(data_file)
-
-                    if FOCUS == "single_players":
-                        find_players(csv_reader)
-                    elif FOCUS == "teams":
-                        find_teams(csv_reader)
+                    csv_reader = read_rows(context, data_file, concatenated=True)
 
-                    viz_data = parse_data_to_json_format(csv_reader, data_file)
+                    # teams and players are found while reading the file, so no pre-scan is needed
+                    viz_data = parse_data_to_json_format(context, csv_reader, data_file)
 
                     print('\tDone writing to : ' + output_file + '.json')
                     ind += 1
 
-            with open(out_folder + output_file + '.json', 'w') as outfile:
-                json.dump(viz_data, outfile)
-                outfile.close()
+            write_output(context, out_folder, output_file, viz_data, context.single_graph)
+    return context
+
+
+def parse_team_file(input_folder, filename, settings=None, rounds_index=None):
+    """
+    parse a team file onto a partial graph of its own, used by the worker processes
+    :param input_folder: folder containing raw data files
+    :param filename: name of the team file
+    :param settings: settings of the analysis (see ProcessingContext.settings, default: the module settings)
+    :param rounds_index: index of the round markers of the file, if a round window is set (default: loaded from
+    ROUNDS_FOLDER); see ProcessingContext.worker_arguments
+    :return: the partial graph of the team, indexed by experimental condition
+    """
+    # each partial graph starts from scratch in a context of its own, also when the worker process has already
+    # parsed other files, so it is never mixed with the graphs the partial graphs are reduced onto
+    context = ProcessingContext(settings=settings)
+    context.rounds_index = rounds_index
+    with open(input_folder + filename, 'rU') as data_file:
+        csv_reader = read_rows(context, data_file)
+        return parse_team_graph(context, csv_reader, filename)
+
+
+def parse_team_file_worker(arguments):
+    return parse_team_file(*arguments)
+
+
+def reduce_partial_graph(context, partial):
+    """
+    add the partial graph of a single team to the graph of its experimental condition and store its visualization;
+    partial graphs must be reduced in the order their files are processed serially
+    :param context: the processing context, holding the graphs of the experimental conditions
+    :param partial: the partial graph returned by parse_team_file
+    :return:
+    """
+    # increase the count of teams
+    context.target_count = context.target_count + 1
+
+    exp_cond = partial.index
+    if exp_cond in context.graphs:
+        graph = context.graphs[exp_cond]
+    else:
+        graph = Graph()
+        graph.index = exp_cond
+        if exp_cond != "":
+            context.graphs[exp_cond] = graph
+
+    # replay the team's trajectory onto the graph of its experimental condition, so that state ids, links and
+    # trajectories are built in the same order as when the team is parsed directly onto that graph
+    # (the partial graph itself is not used as it is, because loading it from the cache does not preserve that order)
+    for value in partial.trajectories.values():
+        for team in value['user_ids']:
+            trajectory = [0]  # initialize with start state
+            for state_id in value['trajectory'][1:-1]:
+                state = partial.states[state_id]
+                graph.add_event_string_based(state['details']['event_type'], state['type'], team, trajectory, None)
+            graph.close_graph(trajectory, team, partial.encoded_action_meaning(value)[:-1])
+
+    store_visualization(context, graph)
+
+
+def hash_file(path):
+    """
+    compute the hash of the content of a file
+    :param path: path of the file
+    :return: the hex digest of the content
+    """
+    content_hash = hashlib.sha1()
+    with open(path, 'rb') as data_file:
+        for chunk in iter(lambda: data_file.read(1 << 20), b''):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
+
+
+def partial_name(path):
+    """
+    :param path: path of a raw data file
+    :return: name of the cached partial graph of the file, which depends on its full path, so that files with the
+    same name in different folders do not share it
+    """
+    return os.path.basename(path) + "-" + hashlib.sha1(os.path.abspath(path)).hexdigest()[:16] + ".pickle"
+
+
+def partial_graph_data(graph):
+    """
+    get a partial graph as plain data (dictionaries, lists and strings) to be cached: a pickled Graph could only be
+    loaded by a process importing its class from the same module
+    :param graph: the partial graph of a team (see parse_team_file)
+    :return: dictionary of the states, links and trajectories of the graph, with its index, count of targets and
+    event vocabulary
+    """
+    return {'index': graph.index,
+            'target_count': graph.target_count,
+            'event_names': list(graph.event_names),
+            'states': graph.states,
+            'links': graph.links,
+            'trajectories': [dict(value, action_meaning=list(value['action_meaning']))
+                             for value in graph.trajectories.values()]}
+
+
+def load_partial_graph(data):
+    """
+    rebuild a partial graph from its cached data (see partial_graph_data)
+    :param data: the cached data of the graph
+    :return: the partial graph
+    """
+    graph = Graph()
+    graph.index = data['index']
+    graph.target_count = data['target_count']
+    graph.event_names = data['event_names']
+    for state_id in sorted(data['states'].keys()):
+        state = data['states'][state_id]
+        graph.states[state_id] = state
+        graph.index_state(state_id, None, state['details']['event_type'])
+        graph.state_users[state_id] = set(state['user_ids'])
+    for uid, link in data['links'].items():
+        graph.links[uid] = link
+        graph.link_users[uid] = set(link['user_ids'])
+    for value in data['trajectories']:
+        action_meaning = array('H', value['action_meaning'])
+        key = action_meaning.tostring()
+        graph.trajectories[key] = dict(value, action_meaning=action_meaning, id=key)
+    return graph
+
+
+def cache_settings(context):
+    """
+    the settings the cached partial graphs depend on: if they change, all the files must be parsed again
+    :param context: the processing context
+    :return:
+    """
+    settings = context.settings()
+    settings.update({'format': CACHE_FORMAT,
+                     'action_meaning': 'event codes',
+                     'trajectory_key': 'event code bytes',
+                     'round_separator': ROUND_SEPARATOR,
+                     'setup_events': sorted(SETUP_EVENTS),
+                     # thresholds of the states derived from the rows of the teams
+                     'thresholds': {'risk_threshold_low': RISK_THRESHOLD_LOW,
+                                    'risk_threshold_medium': RISK_THRESHOLD_MEDIUM,
+                                    'risk_difference_negligible': RISK_DIFFERENCE_NEGLIGIBLE,
+                                    'proneness_difference_low': PRONENESS_DIFFERENCE_LOW,
+                                    'proneness_difference_high': PRONENESS_DIFFERENCE_HIGH,
+                                    'st_dev_decimals': ST_DEV_DECIMALS}})
+    return settings
+
+
+def parse_team_files_incrementally(context, input_folder, filenames, cache_folder, workers=1):
+    """
+    get the partial graphs of the team files, parsing only the files that are new or changed since the last run
+    and loading the partial graphs of the other files from the cache
+    :param context: the processing context, whose settings the files are parsed with
+    :param input_folder: folder containing raw data files
+    :param filenames: names of the team files
+    :param cache_folder: folder containing the manifest and the cached partial graphs
+    :param workers: number of worker processes parsing the files (1 means parsing them in this process)
+    :return: the partial graphs, in the same order as filenames
+    """
+    if not os.path.isdir(cache_folder):
+        os.makedirs(cache_folder)
+
+    manifest = {}
+    if os.path.exists(cache_folder + MANIFEST_FILE):
+        with open(cache_folder + MANIFEST_FILE) as manifest_file:
+            manifest = json.load(manifest_file)
+    if manifest.get('settings') != cache_settings(context):
+        # the partial graphs cached with other settings (or in an older format) are stale
+        for entry in manifest.get('files', {}).values():
+            if os.path.exists(cache_folder + entry['partial']):
+                os.remove(cache_folder + entry['partial'])
+        manifest = {'settings': cache_settings(context), 'files': {}}
+    entries = manifest['files']
+
+    # find the files that are new or changed: size and mtime are checked first, and the content hash
+    # only if they differ, so that files that have just been touched are not parsed again
+    to_parse = []
+    for filename in filenames:
+        path = input_folder + filename
+        file_stat = os.stat(path)
+        entry = entries.get(path)
+        if entry is not None and os.path.exists(cache_folder + entry['partial']):
+            if entry['size'] == file_stat.st_size and entry['mtime'] == file_stat.st_mtime:
+                continue
+            if entry['size'] == file_stat.st_size and entry['hash'] == hash_file(path):
+                entry['mtime'] = file_stat.st_mtime
+                continue
+        entries[path] = {'size': file_stat.st_size,
+                         'mtime': file_stat.st_mtime,
+                         'hash': hash_file(path),
+                         'partial': partial_name(path)}
+        to_parse.append(filename)
+
+    print("parsing " + str(len(to_parse)) + " new or changed files out of " + str(len(filenames)))
+
+    if workers > 1 and len(to_parse) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            parsed = pool.map(parse_team_file_worker,
+                              [context.worker_arguments(input_folder, filename) for filename in to_parse])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [parse_team_file(*context.worker_arguments(input_folder, filename)) for filename in to_parse]
+
+    partials = dict(zip(to_parse, parsed))
+    for filename, partial in partials.items():
+        with open(cache_folder + entries[input_folder + filename]['partial'], 'wb') as partial_file:
+            pickle.dump(partial_graph_data(partial), partial_file, pickle.HIGHEST_PROTOCOL)
+
+    # forget the files that have been removed
+    paths = set(input_folder + filename for filename in filenames)
+    for path in list(entries.keys()):
+        if path not in paths:
+            if os.path.exists(cache_folder + entries[path]['partial']):
+                os.remove(cache_folder + entries[path]['partial'])
+            del entries[path]
+
+    output_files.write_document(cache_folder + MANIFEST_FILE, manifest)
 
+    # load the cached partial graphs of the files that have not been parsed
+    for filename in filenames:
+        if filename not in partials:
+            with open(cache_folder + entries[input_folder + filename]['partial'], 'rb') as partial_file:
+                partials[filename] = load_partial_graph(pickle.load(partial_file))
 
-def process_data_files_by_condition(input_folder, out_folder):
+    return [partials[filename] for filename in filenames]
+
+
+def process_data_files_by_condition(input_folder, out_folder, workers=1, cache_folder=None, context=None):
     """
     process each csv file to create one or more json files for glyph, each json file named according to some criteria
     :param input_folder: folder containing raw data files
     :param out_folder: output folder
-    :return:
+    :param workers: number of worker processes parsing the files (1 means parsing them in this process)
+    :param cache_folder: if given, only new or changed files are parsed and the partial graphs
+    of the other files are loaded from this folder
+    :param context: the processing context of the analysis (default: a new one)
+    :return: the processing context
     """
+    if context is None:
+        context = ProcessingContext()
 
+    filenames = []
     for subdir, dirs, files in os.walk(input_folder):
 
         for filename in files:
@@ -1250,23 +1946,39 @@ def process_data_files_by_condition(input_folder, out_folder):
             ext = os.path.basename(filename).split('.')[1]
 
             if ext == 'csv':
+                filenames.append(filename)
+
+    if cache_folder is not None:
+        # reduce the partial graphs in file order, whether they have just been parsed or loaded from the cache
+        for partial in parse_team_files_incrementally(context, input_folder, filenames, cache_folder, workers):
+            reduce_partial_graph(context, partial)
+    elif workers > 1:
+        # parse each file onto a partial graph in a worker process, then reduce the partial graphs in file order
+        pool = multiprocessing.Pool(workers)
+        try:
+            arguments = [context.worker_arguments(input_folder, filename) for filename in filenames]
+            for partial in pool.imap(parse_team_file_worker, arguments):
+                reduce_partial_graph(context, partial)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for filename in filenames:
+            with open(input_folder + filename, 'rU') as data_file:
+                csv_reader = read_rows(context, data_file)
 
-                with open(input_folder + filename, 'rU') as data_file:
-                    csv_reader = csv.reader(data_file)
-
-                    # viz_data = parse_team_data_onto_multiple_json_files(csv_reader, filename)
-                    parse_team_data_onto_multiple_json_files(csv_reader, filename)
+                # viz_data = parse_team_data_onto_multiple_json_files(csv_reader, filename)
+                parse_team_data_onto_multiple_json_files(context, csv_reader, filename)
 
-    for exp_cond, viz_data in VISUALIZATIONS.items():
+    for exp_cond, graph in context.visualizations.items():
 
         output_file = exp_cond
-        FILE_NAMES_LIST.append(output_file)
+        context.file_names.append(output_file)
 
-        with open(out_folder + output_file + '.json', 'w') as outfile:
-            json.dump(viz_data, outfile)
-            outfile.close()
+        write_output(context, out_folder, output_file, visualization_document(graph), graph)
 
         print('\tDone writing to file : ' + output_file + '.json')
+    return context
 
 
 
@@ -1276,20 +1988,63 @@ if __name__ == "__main__":
     # create_game_action_dict(GAME_ACTIONS)
     # print(ACTIONS)
 
+    parser = argparse.ArgumentParser(description="create the json files for glyph from the raw data files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing the raw data files and computing the edit distances "
+                             "among trajectories (default: 1)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="parse only the raw data files that are new or changed since the last run, "
+                             "reusing the partial graphs cached in " + CACHE_FOLDER)
+    parser.add_argument("--event-cache", action="store_true",
+                        help="read the raw data files from their columnar event caches in ../data/event_cache/, "
+                             "building them the first time")
+    parser.add_argument("--similarity", choices=["counts", "edit", "minhash"],
+                        help="compute the similarities among trajectories with the given metric "
+                             "(default: the similarities are not computed)")
+    parser.add_argument("--rounds", type=int, nargs=2, metavar=("FIRST", "LAST"),
+                        help="add only the rounds from FIRST to LAST of each team to the graphs, seeking them with "
+                             "the index of the round markers in " + ROUNDS_FOLDER + " (see check_rounds.py)")
+    compression = parser.add_mutually_exclusive_group()
+    compression.add_argument("--gzip", action="store_true",
+                             help="write the files for glyph compressed with gzip (.gz)")
+    compression.add_argument("--precompress", action="store_true",
+                             help="write the files for glyph both uncompressed and compressed with gzip (.gz) "
+                                  "and, if installed, brotli (.br)")
+    parser.add_argument("--serializer", choices=sorted(output_files.SERIALIZERS.keys()), default="json",
+                        help="format of the files for glyph (default: json); "
+                             "falls back to json if the serializer is not installed")
+    args = parser.parse_args()
+
+    SIMILARITY_METRIC = args.similarity
+    SIMILARITY_WORKERS = args.workers
+    COMPRESS_OUTPUT = args.gzip
+    PRECOMPRESS_OUTPUT = args.precompress
+    SERIALIZER = args.serializer
+    if args.event_cache:
+        EVENT_CACHE_FOLDER = "../data/event_cache/"
+
     raw_data_folder = "../data/raw/"
     output_folder = "../data/output/"
 
-    # process_data(raw_data_folder, output_folder, action_from_file=True)
+    try:
+        context = ProcessingContext(settings={'round_window': args.rounds})
+    except ValueError as error:
+        parser.error(str(error))
 
-    process_data_files_by_condition(raw_data_folder, output_folder)
+    # process_data(raw_data_folder, output_folder, action_from_file=True, context=context)
+
+    process_data_files_by_condition(raw_data_folder, output_folder, args.workers,
+                                    CACHE_FOLDER if args.incremental else None, context)
 
     # print(STATES)
 
     # print("File names of visualization_ids.json")
-    # print(json.dumps(FILE_NAMES_LIST))
+    # print(json.dumps(context.file_names))
 
     # generate the visualization_ids.json file
-    with open(output_folder + 'visualization_ids.json', 'w') as outfile:
-        json.dump(FILE_NAMES_LIST, outfile)
-        outfile.close()
-        print("\nvisualization_ids.json file generated.")
+    write_output(context, output_folder, 'visualization_ids', context.file_names)
+    print("\nvisualization_ids file generated.")
+
+    # generate the manifest of the files for glyph, with their sizes, counts and content hashes
+    output_files.write_document(output_folder + OUTPUT_MANIFEST_FILE, context.output_manifest)
+    print(OUTPUT_MANIFEST_FILE + " file generated.")
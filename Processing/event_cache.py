@@ -0,0 +1,263 @@
+import json
+import csv
+import os
+import pickle
+import hashlib
+import numpy as np
+
+EVENT_COLUMN = 0  # column containing the events (including player actions)
+ITEM_COLUMN = 2  # column where used mining item is specified
+ITEM_PROBABILITY_COLUMN = 4  # column where items' probability of success are written during setup
+PLAYER_ID_COLUMN = 2  # column containing the player id (old data: column 2; new data: column 3)
+FOUND_GOLD_COLUMN = 4  # column containing the amount of gold found by the player
+TOTAL_GOLD_COLUMN = 2  # column containing the total amount of gold collected by the team
+POSITION_COLUMN = 3  # column containing the start position of "SetDestination" and the "ArrivedTo" position)
+POSITION_EVENTS = {"ArrivedTo", "SetDestination"}  # events whose position is parsed
+
+MISSING = -1  # code of the cells missing from rows shorter than the widest row
+ROWS_PER_CHUNK = 4096  # rows decoded at once when the cached rows are read back as lists of strings
+SOURCE_FILE = "source.json"  # path, size and mtime of the csv file the cache has been built from
+STRINGS_FILE = "strings.pickle"  # table of the interned strings of the cache (pickled to keep their str type)
+
+# arrays of the cache, each stored in its own .npy file so that it can be memory mapped
+ARRAYS = ["cells", "lengths", "gold", "probability", "probability_max", "x", "y"]
+
+
+def parse_position(position):
+    """
+    parse a position written as "(x y)"
+    :param position: the position string
+    :return: the x and y coordinates
+    """
+    coordinates = position.strip("()").split()
+    return int(coordinates[0]), int(coordinates[1])
+
+
+def build_event_cache(csv_path, cache_path):
+    """
+    convert a raw csv log into a columnar cache: every cell is interned into a table of strings and stored as an
+    integer code, and the numeric columns (gold, probabilities of success, positions) are parsed once
+    :param csv_path: path of the csv file
+    :param cache_path: folder where the arrays of the cache are written
+    :return:
+    """
+    strings = []
+    codes = {}
+    rows = []
+    gold = []
+    probability = []
+    probability_max = []
+    x = []
+    y = []
+
+    with open(csv_path, 'rU') as data_file:
+        for row in csv.reader(data_file):
+            row_codes = []
+            for cell in row:
+                code = codes.get(cell)
+                if code is None:
+                    code = codes[cell] = len(strings)
+                    strings.append(cell)
+                row_codes.append(code)
+            rows.append(row_codes)
+
+            event = row[EVENT_COLUMN] if row else ""
+            row_gold = np.nan
+            row_probability = np.nan
+            row_probability_max = np.nan
+            row_x = MISSING
+            row_y = MISSING
+            if event == "TotalGold" and len(row) > TOTAL_GOLD_COLUMN:
+                row_gold = float(row[TOTAL_GOLD_COLUMN])
+            elif event == "FoundGold" and len(row) > FOUND_GOLD_COLUMN:
+                row_gold = float(row[FOUND_GOLD_COLUMN])
+            elif event == "ItemSetup" and len(row) > ITEM_PROBABILITY_COLUMN:
+                row_probability = float(row[ITEM_PROBABILITY_COLUMN])
+            elif event == "MineSetup" and len(row) > ITEM_PROBABILITY_COLUMN:
+                # mines have a min and max probability of success
+                prob_list = row[ITEM_PROBABILITY_COLUMN].strip("()").split()
+                row_probability = float(prob_list[0])
+                row_probability_max = float(prob_list[1])
+            elif event in POSITION_EVENTS and len(row) > POSITION_COLUMN:
+                row_x, row_y = parse_position(row[POSITION_COLUMN])
+            gold.append(row_gold)
+            probability.append(row_probability)
+            probability_max.append(row_probability_max)
+            x.append(row_x)
+            y.append(row_y)
+
+    width = max([len(row_codes) for row_codes in rows] + [1])
+    cells = np.full((len(rows), width), MISSING, dtype=np.int32)
+    for i, row_codes in enumerate(rows):
+        cells[i, :len(row_codes)] = row_codes
+
+    arrays = {"cells": cells,
+              "lengths": np.array([len(row_codes) for row_codes in rows], dtype=np.int16),
+              "gold": np.array(gold, dtype=np.float64),
+              "probability": np.array(probability, dtype=np.float64),
+              "probability_max": np.array(probability_max, dtype=np.float64),
+              "x": np.array(x, dtype=np.int32),
+              "y": np.array(y, dtype=np.int32)}
+
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    elif os.path.exists(os.path.join(cache_path, SOURCE_FILE)):
+        os.remove(os.path.join(cache_path, SOURCE_FILE))
+    for name in ARRAYS:
+        np.save(os.path.join(cache_path, name + ".npy"), arrays[name])
+    with open(os.path.join(cache_path, STRINGS_FILE), 'wb') as strings_file:
+        pickle.dump(strings, strings_file, pickle.HIGHEST_PROTOCOL)
+
+    # the source is written last, so that an interrupted build is never taken for a valid cache
+    with open(os.path.join(cache_path, SOURCE_FILE), 'w') as source_file:
+        json.dump(source_signature(csv_path), source_file)
+
+
+class EventCache:
+    """
+    columnar cache of a raw csv log, whose arrays are memory mapped
+    """
+    def __init__(self, cache_path):
+        self.path = cache_path
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(cache_path, name + ".npy"), mmap_mode='r'))
+        with open(os.path.join(cache_path, STRINGS_FILE), 'rb') as strings_file:
+            self.strings = pickle.load(strings_file)
+        self.codes = dict((string, code) for code, string in enumerate(self.strings))
+
+        # the columns most analyses need
+        self.events = self.cells[:, EVENT_COLUMN]
+        self.players = self.cells[:, PLAYER_ID_COLUMN] if self.cells.shape[1] > PLAYER_ID_COLUMN else None
+        self.items = self.cells[:, ITEM_COLUMN] if self.cells.shape[1] > ITEM_COLUMN else None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def code(self, string):
+        """
+        :param string: a string, for instance an event name
+        :return: the code of the string, or MISSING if the string does not occur in the log
+        """
+        return self.codes.get(string, MISSING)
+
+    def count(self, event):
+        """
+        :param event: an event name
+        :return: the number of rows of the event
+        """
+        return int(np.count_nonzero(self.events == self.code(event)))
+
+    def rows(self, start=0, stop=None):
+        """
+        decode the rows back into lists of strings, exactly as returned by the csv reader
+        :param start: first row to decode
+        :param stop: row after the last one to decode (default: the end of the log)
+        :return: generator of the rows
+        """
+        stop = len(self) if stop is None else stop
+        strings = self.strings
+        for chunk_start in range(start, stop, ROWS_PER_CHUNK):
+            chunk_stop = min(chunk_start + ROWS_PER_CHUNK, stop)
+            cells = self.cells[chunk_start:chunk_stop].tolist()
+            lengths = self.lengths[chunk_start:chunk_stop].tolist()
+            for row_codes, length in zip(cells, lengths):
+                yield [strings[code] for code in row_codes[:length]]
+
+
+class CachedRows:
+    """
+    rows of a cache from start to stop, iterated as lists of strings like the rows of the csv reader; the parsers can
+    also read their events in batch from the cached codes (see data_parsing_gallup.TeamSessionMachine.feed_cached)
+    """
+    def __init__(self, cache, start=0, stop=None):
+        self.cache = cache
+        self.start = start
+        self.stop = len(cache) if stop is None else stop
+
+    def __iter__(self):
+        return self.cache.rows(self.start, self.stop)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def row(self, position):
+        """
+        :param position: position of a row, counted from start
+        :return: the row, as a list of strings
+        """
+        position += self.start
+        strings = self.cache.strings
+        return [strings[code] for code in self.cache.cells[position, :self.cache.lengths[position]].tolist()]
+
+    def encode_events(self, encode):
+        """
+        translate the events of the rows into the codes of another vocabulary
+        :param encode: function giving the code of an event in the other vocabulary, called once per distinct event,
+        in the order the events first occur
+        :return: array of the codes of the events of the rows (as unsigned 16 bit integers)
+        """
+        events = np.asarray(self.cache.events[self.start:self.stop])
+        distinct, first, inverse = np.unique(events, return_index=True, return_inverse=True)
+        if len(distinct) > 0 and distinct[0] == MISSING:
+            # an empty row has no event, as when it is read with the csv reader
+            raise IndexError("empty row " + str(self.start + first[0]) + " of " + self.cache.path)
+        translation = np.zeros(len(distinct), dtype=np.uint16)
+        for i in np.argsort(first, kind='mergesort'):
+            translation[i] = encode(self.cache.strings[distinct[i]])
+        return translation[inverse]
+
+
+def find_codes(codes, wanted):
+    """
+    :param codes: array of codes
+    :param wanted: the codes to find
+    :return: list of the positions of the wanted codes in the array
+    """
+    return np.flatnonzero(np.in1d(codes, list(wanted))).tolist()
+
+
+def source_signature(csv_path):
+    """
+    :param csv_path: path of the csv file
+    :return: absolute path, size and mtime of the csv file, which identify the version a cache has been built from
+    """
+    file_stat = os.stat(csv_path)
+    return {'path': os.path.abspath(csv_path), 'size': file_stat.st_size, 'mtime': file_stat.st_mtime}
+
+
+def cache_name(csv_path):
+    """
+    :param csv_path: path of the csv file
+    :return: name of the folder of the cache of the csv file: its file name followed by the hash of its absolute path,
+    so that files with the same name in different folders (e.g. the raw data and the files to check) have their own
+    cache
+    """
+    path_hash = hashlib.sha1(os.path.abspath(csv_path)).hexdigest()[:16]
+    return os.path.basename(csv_path) + "-" + path_hash
+
+
+def is_up_to_date(csv_path, cache_path):
+    """
+    :param csv_path: path of the csv file
+    :param cache_path: folder of the cache
+    :return: True if the cache has been built from the current version of the csv file
+    """
+    source_path = os.path.join(cache_path, SOURCE_FILE)
+    if not os.path.exists(source_path):
+        return False
+    with open(source_path) as source_file:
+        source = json.load(source_file)
+    return source == source_signature(csv_path)
+
+
+def load_event_cache(csv_path, cache_folder):
+    """
+    load the cache of a csv file, building it first if it does not exist or the csv file has changed
+    :param csv_path: path of the csv file
+    :param cache_folder: folder containing the caches of the csv files, indexed by cache_name
+    :return: the cache of the csv file
+    """
+    cache_path = os.path.join(cache_folder, cache_name(csv_path))
+    if not is_up_to_date(csv_path, cache_path):
+        build_event_cache(csv_path, cache_path)
+    return EventCache(cache_path)
@@ -0,0 +1,285 @@
+import os
+import gzip
+import json
+import hashlib
+import collections
+
+try:
+    import ujson  # faster json encoder, used by the "ujson" serializer when installed
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack  # binary alternative to json, used by the "msgpack" serializer when installed
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli  # used for the .br precompressed outputs when installed
+except ImportError:
+    brotli = None
+
+ITEMS_PER_CHUNK = 1000  # items of a streamed list encoded before being written to the file
+TEMP_SUFFIX = ".tmp"  # suffix of the temporary files the outputs are written to before being renamed
+BYTES_PER_CHUNK = 1 << 20  # bytes of an output read at once when its precompressed variants are written
+COMPRESSIONS = [("gzip", ".gz"), ("brotli", ".br")]  # compressions of the precompressed variants, with their suffix
+MISSING_COMPRESSIONS = set()  # compressions whose missing module has already been reported
+
+
+def hash_file(path):
+    """
+    :param path: path of the file
+    :return: sha1 hex digest of the content of the file
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as hashed_file:
+        for chunk in iter(lambda: hashed_file.read(BYTES_PER_CHUNK), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+class HashingFile:
+    """
+    file keeping the sha1 and the size of what is written to it
+    """
+    def __init__(self, output_file):
+        self.file = output_file
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.sha1.update(data)
+        self.size += len(data)
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BrotliFile:
+    """
+    file whose content is compressed with brotli
+    """
+    def __init__(self, output_file):
+        self.file = output_file
+        self.compressor = brotli.Compressor()
+
+    def write(self, data):
+        self.file.write(self.compressor.process(data))
+
+    def close(self):
+        self.file.write(self.compressor.finish())
+
+
+class AtomicOutput:
+    """
+    file written to a temporary file next to its path, which is renamed to the path only when it has been completely
+    written: readers never see a partial output, and a failed write leaves the previous output in place;
+    if the new content is the same as the previous output, the previous output is kept, with its modification time
+    """
+    def __init__(self, path, compression=None):
+        """
+        :param path: path of the output
+        :param compression: None, "gzip" or "brotli"
+        """
+        self.path = path
+        self.temp_path = path + TEMP_SUFFIX
+        self.compression = compression
+        self.raw_file = None
+        self.file = None
+        self.changed = True  # False if the previous output has been kept
+
+    def __enter__(self):
+        self.raw_file = HashingFile(open(self.temp_path, 'wb'))
+        if self.compression == "gzip":
+            # no name and no timestamp in the gzip header, so that the same content gives the same file
+            self.file = gzip.GzipFile(filename="", mode='wb', fileobj=self.raw_file, mtime=0)
+        elif self.compression == "brotli":
+            self.file = BrotliFile(self.raw_file)
+        else:
+            self.file = self.raw_file
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.compression is not None:
+            self.file.close()
+        self.raw_file.close()
+        if exc_type is not None:
+            os.remove(self.temp_path)
+        elif (os.path.exists(self.path) and os.path.getsize(self.path) == self.size
+              and hash_file(self.path) == self.hash):
+            os.remove(self.temp_path)
+            self.changed = False
+        else:
+            os.rename(self.temp_path, self.path)
+        return False
+
+    @property
+    def hash(self):
+        """
+        :return: sha1 hex digest of the written file
+        """
+        return self.raw_file.sha1.hexdigest()
+
+    @property
+    def size(self):
+        """
+        :return: size in bytes of the written file
+        """
+        return self.raw_file.size
+
+
+class JsonSerializer:
+    """
+    stdlib json serializer, with the same output as json.dump
+    """
+    name = "json"
+    extension = ".json"
+    item_separator = ", "
+    key_separator = ": "
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder()
+
+    def encode(self, value):
+        return self.encoder.encode(value)
+
+    def chunks(self, value):
+        """
+        encode a value in chunks: dictionaries are encoded key by key, and iterators (for instance the values of a
+        dictionary, or a generator) item by item, so that they never need to be copied into a list
+        :param value: the value to encode
+        :return: generator of the chunks of the encoded value
+        """
+        if isinstance(value, dict):
+            yield '{'
+            first = True
+            for key, item in value.items():
+                yield ('' if first else self.item_separator) + self.encode(key) + self.key_separator
+                for chunk in self.chunks(item):
+                    yield chunk
+                first = False
+            yield '}'
+        elif isinstance(value, collections.Iterator):
+            yield '['
+            first = True
+            items = []
+            for item in value:
+                items.append(self.encode(item))
+                if len(items) == ITEMS_PER_CHUNK:
+                    yield ('' if first else self.item_separator) + self.item_separator.join(items)
+                    first = False
+                    items = []
+            if items:
+                yield ('' if first else self.item_separator) + self.item_separator.join(items)
+            yield ']'
+        else:
+            yield self.encode(value)
+
+    def write(self, output_file, document):
+        for chunk in self.chunks(document):
+            output_file.write(chunk)
+
+
+class UjsonSerializer(JsonSerializer):
+    """
+    json serializer using the ujson encoder, which writes compact json (no spaces after separators)
+    """
+    name = "ujson"
+    item_separator = ","
+    key_separator = ":"
+
+    def encode(self, value):
+        return ujson.dumps(value, escape_forward_slashes=False)
+
+
+class MsgpackSerializer:
+    """
+    messagepack serializer: the items of the iterators are packed one by one, but they are held until the iterator
+    is exhausted because the length of an array is written before its items
+    """
+    name = "msgpack"
+    extension = ".msgpack"
+
+    def __init__(self):
+        # strings are packed as raw strings (not binary), so that they are decoded as strings
+        self.packer = msgpack.Packer(use_bin_type=False)
+
+    def write(self, output_file, document):
+        if isinstance(document, dict):
+            output_file.write(self.packer.pack_map_header(len(document)))
+            for key, item in document.items():
+                output_file.write(self.packer.pack(key))
+                self.write(output_file, item)
+        elif isinstance(document, collections.Iterator):
+            items = [self.packer.pack(item) for item in document]
+            output_file.write(self.packer.pack_array_header(len(items)))
+            for item in items:
+                output_file.write(item)
+        else:
+            output_file.write(self.packer.pack(document))
+
+
+SERIALIZERS = {  # serializers by name, with the optional module they need
+    "json": (JsonSerializer, json),
+    "ujson": (UjsonSerializer, ujson),
+    "msgpack": (MsgpackSerializer, msgpack)
+}
+MISSING_SERIALIZERS = set()  # serializers whose fallback has already been reported
+
+
+def get_serializer(name="json"):
+    """
+    :param name: name of the serializer ("json", "ujson" or "msgpack")
+    :return: the serializer, or the stdlib json serializer if the module the serializer needs is not installed
+    """
+    serializer_class, module = SERIALIZERS[name]
+    if module is None:
+        if name not in MISSING_SERIALIZERS:
+            MISSING_SERIALIZERS.add(name)
+            print("the " + name + " serializer is not installed, falling back to json")
+        return JsonSerializer()
+    return serializer_class()
+
+
+def write_document(path, document, serializer=None, compress=False):
+    """
+    stream a document to a file, writing it atomically (see AtomicOutput)
+    :param path: path of the output
+    :param document: the document; the values that are iterators are written as lists
+    :param serializer: the serializer of the document (default: json)
+    :param compress: if True, the output is compressed with gzip
+    :return: the output, with its hash and size and whether it changed
+    """
+    serializer = serializer or JsonSerializer()
+    output = AtomicOutput(path, "gzip" if compress else None)
+    with output as output_file:
+        serializer.write(output_file, document)
+    return output
+
+
+def write_compressed_variants(path, changed=True):
+    """
+    write the precompressed variants of an output next to it (path.gz and, if brotli is installed, path.br);
+    the variants of an unchanged output are only written if they are missing
+    :param path: path of the output
+    :param changed: False if the output has not changed since its variants were written
+    :return: dictionary of the sizes in bytes of the variants, indexed by suffix
+    """
+    sizes = {}
+    for compression, suffix in COMPRESSIONS:
+        if compression == "brotli" and brotli is None:
+            if compression not in MISSING_COMPRESSIONS:
+                MISSING_COMPRESSIONS.add(compression)
+                print("brotli is not installed, the " + suffix + " precompressed variants are not written")
+            continue
+        if changed or not os.path.exists(path + suffix):
+            with AtomicOutput(path + suffix, compression) as output_file:
+                with open(path, 'rb') as input_file:
+                    for chunk in iter(lambda: input_file.read(BYTES_PER_CHUNK), b''):
+                        output_file.write(chunk)
+        sizes[suffix] = os.path.getsize(path + suffix)
+    return sizes
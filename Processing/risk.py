@@ -0,0 +1,129 @@
+import numpy as np
+
+START_VOTATION_COLUMN_1 = 2  # column containing 1st mining tool available for voting
+START_VOTATION_COLUMN_2 = 3  # column containing 2nd mining tool available for voting
+ITEM_SELECTED_COLUMN = 2  # column containing the item selected by the leader
+ITEM_COLUMN = 2  # column where items' names are written during setup
+MINE = "Mine"  # items whose name contains this are mines, whose probability of success is their minimum one
+
+RISKS = np.array(["n.a.", "negligible", "low", "high"], dtype=object)  # risk labels, indexed by risk code
+PRONENESS = np.array(["", "low", "medium", "high"], dtype=object)  # risk proneness labels, indexed by proneness code
+
+
+def classify_risks(item1_probs, item2_probs, selected_first, negligible, proneness_low, proneness_high):
+    """
+    classify the risk taken by the leader in each decision of a session, and the risk proneness shown by the decisions
+    taking a high risk, as data_parsing_gallup.classify_risk does for a single decision
+    :param item1_probs: probabilities of success of the first item to choose from
+    :param item2_probs: probabilities of success of the second item to choose from
+    :param selected_first: True where the leader selected the first item
+    :param negligible: differences between the probabilities up to this are negligible
+    :param proneness_low: high risks taken on differences up to this show a low risk proneness
+    :param proneness_high: high risks taken on differences from this show a high risk proneness
+    :return: arrays of the risk labels and of the risk proneness labels ("" where the risk is not high)
+    """
+    differences = np.abs(item1_probs - item2_probs)
+
+    risk_codes = np.full(len(differences), 2, dtype=np.int8)
+    risk_codes[selected_first & (item1_probs < item2_probs)] = 3
+    risk_codes[differences <= negligible] = 1
+    risk_codes[item1_probs == item2_probs] = 0
+
+    proneness_codes = np.where(differences <= proneness_low, 1, np.where(differences < proneness_high, 2, 3))
+    proneness_codes[risk_codes != 3] = 0
+    return RISKS[risk_codes], PRONENESS[proneness_codes]
+
+
+def item_probabilities(rows, positions, codes, item_setup_code, mine_setup_code):
+    """
+    :param rows: the cached rows of a session (see event_cache.CachedRows)
+    :param positions: positions of the setup rows of the session
+    :param codes: codes of the events of the rows
+    :param item_setup_code: code of the ItemSetup event
+    :param mine_setup_code: code of the MineSetup event
+    :return: dictionaries of the probabilities of success of the mining tools and of the mines, indexed by the code of
+    their name in the cache
+    """
+    cache = rows.cache
+    tools = {}
+    mines = {}
+    for position in positions:
+        name = int(cache.cells[rows.start + position, ITEM_COLUMN])
+        if codes[position] == item_setup_code:
+            tools[name] = float(cache.probability[rows.start + position])
+        elif codes[position] == mine_setup_code:
+            mines[name] = float(cache.probability[rows.start + position])
+    return tools, mines
+
+
+def session_decisions(rows, codes, votation_code, selection_code, item_setup_code, mine_setup_code):
+    """
+    gather the decisions of a cached session as arrays: each LeaderSelection row is paired with the StartVotation row
+    preceding it, and the probabilities of success of the items are read from the setup rows of the session
+    :param rows: the cached rows of the session (see event_cache.CachedRows)
+    :param codes: codes of the events of the rows (see event_cache.CachedRows.encode_events)
+    :param votation_code: code of the StartVotation event
+    :param selection_code: code of the LeaderSelection event
+    :param item_setup_code: code of the ItemSetup event
+    :param mine_setup_code: code of the MineSetup event
+    :return: probabilities of success of the first and of the second item to choose from, whether the first item has
+    been selected, and whether the selected item is a mining tool or a mine, for each decision; None if the session
+    has setup rows after its first decision or votes on items that have not been set up, in which case its rows must
+    be parsed one by one
+    """
+    codes = np.asarray(codes)
+    cells = rows.cache.cells
+    lengths = rows.cache.lengths
+    votations = np.flatnonzero(codes == votation_code)
+    selections = np.flatnonzero(codes == selection_code)
+    setups = np.flatnonzero((codes == item_setup_code) | (codes == mine_setup_code))
+
+    decisions = np.concatenate([votations, selections])
+    if len(setups) > 0 and len(decisions) > 0 and setups[-1] > decisions.min():
+        return None
+    if ((lengths[rows.start + votations] <= START_VOTATION_COLUMN_2).any() or
+            (lengths[rows.start + selections] <= ITEM_SELECTED_COLUMN).any()):
+        return None
+
+    tools, mines = item_probabilities(rows, setups, codes, item_setup_code, mine_setup_code)
+    item1_codes = cells[rows.start + votations, START_VOTATION_COLUMN_1]
+    item2_codes = cells[rows.start + votations, START_VOTATION_COLUMN_2]
+    lookup = {}
+    for name in set(item1_codes.tolist()) | set(item2_codes.tolist()):
+        probabilities = mines if rows.cache.strings[name].find(MINE) > -1 else tools
+        if name not in probabilities:
+            return None
+        lookup[name] = probabilities[name]
+    item1_probs = np.array([lookup[name] for name in item1_codes.tolist()] + [0.0])
+    item2_probs = np.array([lookup[name] for name in item2_codes.tolist()] + [0.0])
+    item1_codes = np.append(item1_codes, -1)
+
+    # each selection is paired with the last votation before it (the appended item of probability 0 if none)
+    paired = np.searchsorted(votations, selections) - 1
+    selected_codes = cells[rows.start + selections, ITEM_SELECTED_COLUMN]
+    selected_first = selected_codes == item1_codes[paired]
+    is_item = np.in1d(selected_codes, list(set(tools) | set(mines)))
+    return item1_probs[paired], item2_probs[paired], selected_first, is_item
+
+
+def session_risks(rows, codes, event_codes, negligible, proneness_low, proneness_high):
+    """
+    classify the risk of all the decisions of a cached session at once
+    :param rows: the cached rows of the session (see event_cache.CachedRows)
+    :param codes: codes of the events of the rows (see event_cache.CachedRows.encode_events)
+    :param event_codes: codes of the StartVotation, LeaderSelection, ItemSetup and MineSetup events
+    :param negligible: differences between the probabilities up to this are negligible
+    :param proneness_low: high risks taken on differences up to this show a low risk proneness
+    :param proneness_high: high risks taken on differences from this show a high risk proneness
+    :return: list of the risk and of the risk proneness of each LeaderSelection row, both "" if the selected item is
+    not a mining tool or a mine; None if the session must be parsed one by one (see session_decisions)
+    """
+    decisions = session_decisions(rows, codes, *event_codes)
+    if decisions is None:
+        return None
+    item1_probs, item2_probs, selected_first, is_item = decisions
+    risks, proneness = classify_risks(item1_probs, item2_probs, selected_first, negligible, proneness_low,
+                                      proneness_high)
+    risks[~is_item] = ""
+    proneness[~is_item] = ""
+    return zip(risks.tolist(), proneness.tolist())
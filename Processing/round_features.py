@@ -0,0 +1,158 @@
+"""
+team x round feature table of the raw data files, built in a single pass over each file: one row per team and round
+with the gold of the team, its votes, the risks of its decisions, the items selected, the leader changes and the chat
+messages; the votes are those on the mining tools (tool_votes), whose probabilities of success give voting_st_dev,
+while the votes on the mines, which have a range of probabilities, are not counted
+"""
+import os
+import csv
+import argparse
+import multiprocessing
+
+import data_parsing_gallup as gallup
+import output_files
+
+try:
+    import numpy as np  # only required to write the feature table as .npz
+except ImportError:
+    np = None
+
+RISK_LABELS = ["n.a.", "negligible", "low", "high"]  # risks of the decisions (see data_parsing_gallup.classify_risk)
+KEY_COLUMNS = ["team", "condition"]  # columns identifying the team of each row
+# numeric columns of the table, one row per team and round; NaN (empty in the csv) where a value is undefined
+FEATURE_COLUMNS = (["round", "total_gold", "tool_votes", "voting_st_dev"] +
+                   ["risk_" + label for label in RISK_LABELS] +
+                   ["selections", "mean_selected_prob", "leader_changes", "chat_messages", "censored_messages"])
+NOT_AVAILABLE = float("nan")  # value of the features that are undefined in a round
+
+
+def round_features(round_number, total_gold, aggregates):
+    """
+    :param round_number: number of the round
+    :param total_gold: gold collected by the team when the round ends
+    :param aggregates: RoundAggregates of the round
+    :return: list of the values of FEATURE_COLUMNS of the round
+    """
+    tool_votes = aggregates.tool_votes
+    selected = aggregates.selected
+    return ([round_number, total_gold, tool_votes.count,
+             tool_votes.stdev() if tool_votes.count > 1 else NOT_AVAILABLE] +
+            [aggregates.risk_counts.get(label, 0) for label in RISK_LABELS] +
+            [selected.count, selected.mean if selected.count > 0 else NOT_AVAILABLE, aggregates.leader_changes,
+             aggregates.chat_messages, aggregates.censored_messages])
+
+
+def parse_team_rounds(input_folder, filename):
+    """
+    parse a team file in a single pass, aggregating its rounds online instead of building its graph
+    :param input_folder: folder containing raw data files
+    :param filename: name of the team file
+    :return: list of the rows of the team, as [team, condition] + the values of FEATURE_COLUMNS
+    """
+    # the rows are read as for the graphs, so the event cache is honoured; the round window is not, because its rounds
+    # end with their ROUND_SEPARATOR row, as for the graph labels, while here they start with it: the rounds of a
+    # window are selected by the round column of the table; the events to process are ignored as well
+    context = gallup.ProcessingContext(settings={'events_to_process': set(), 'round_window': None})
+    with open(input_folder + filename, 'rU') as data_file:
+        machine = gallup.TeamSessionMachine(context, filename, gallup.Graph(), per_condition=True, round_features=True)
+        machine.feed_rows(gallup.read_rows(context, data_file))
+        machine.close()
+    return [[filename, machine.exp_cond] + round_features(*ended_round) for ended_round in machine.rounds]
+
+
+def parse_team_rounds_worker(arguments):
+    return parse_team_rounds(*arguments)
+
+
+def extract_round_features(input_folder, workers=1):
+    """
+    build the team x round feature table of the raw data files, one row for each round started by a ROUND_SEPARATOR
+    row (the rounds counted by check_rounds.py): a round ends with the next ROUND_SEPARATOR row, or with the team
+    (where its game ends or is suspended), and the rows before the first round, the setup of the game, are not a round
+    :param input_folder: folder containing raw data files
+    :param workers: number of worker processes parsing the files (1 means parsing them in this process)
+    :return: list of the rows of the table, as [team, condition] + the values of FEATURE_COLUMNS, in file order
+    """
+    filenames = []
+    for subdir, dirs, files in os.walk(input_folder):
+        for filename in files:
+            if os.path.basename(filename).split('.')[1] == 'csv':
+                filenames.append(filename)
+
+    arguments = [(input_folder, filename) for filename in filenames]
+    if workers > 1 and len(filenames) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            teams = pool.map(parse_team_rounds_worker, arguments)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        teams = [parse_team_rounds(*argument) for argument in arguments]
+    return [row for team_rows in teams for row in team_rows]
+
+
+def write_csv(path, table):
+    """
+    write the feature table to a csv file with a header row, writing it atomically (see output_files.AtomicOutput)
+    :param path: path of the csv file
+    :param table: rows of the table (see extract_round_features)
+    :return:
+    """
+    with output_files.AtomicOutput(path) as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(KEY_COLUMNS + FEATURE_COLUMNS)
+        for row in table:
+            # undefined values (NaN) are left empty
+            writer.writerow(["" if value != value else value for value in row])
+
+
+def write_npz(path, table):
+    """
+    write the feature table to a numpy .npz file: "features" is the float matrix of FEATURE_COLUMNS (one row per
+    team and round), "teams" and "conditions" the keys of its rows, and "columns" the names of its columns
+    :param path: path of the .npz file
+    :param table: rows of the table (see extract_round_features)
+    :return:
+    """
+    if np is None:
+        raise ImportError("the .npz feature table needs numpy")
+    features = np.array([row[len(KEY_COLUMNS):] for row in table], dtype=np.float64)
+    np.savez_compressed(path, features=features.reshape(len(table), len(FEATURE_COLUMNS)),
+                        teams=np.array([row[0] for row in table]), conditions=np.array([row[1] for row in table]),
+                        columns=np.array(FEATURE_COLUMNS))
+
+
+def write_round_features(path, table):
+    """
+    write the feature table to a .npz file if the path has the .npz extension, to a csv file otherwise
+    :param path: path of the output
+    :param table: rows of the table (see extract_round_features)
+    :return:
+    """
+    if path.endswith(".npz"):
+        write_npz(path, table)
+    else:
+        write_csv(path, table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write the team x round feature table of the raw data files")
+    parser.add_argument("output", nargs="?", default="../data/output/round_features.csv",
+                        help="output file, written as .npz if it has that extension and as csv otherwise "
+                             "(default: ../data/output/round_features.csv)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes parsing the raw data files (default: 1)")
+    parser.add_argument("--event-cache", action="store_true",
+                        help="read the raw data files from their columnar event caches in ../data/event_cache/, "
+                             "building them the first time")
+    args = parser.parse_args()
+
+    if args.event_cache:
+        gallup.EVENT_CACHE_FOLDER = "../data/event_cache/"
+
+    raw_data_folder = "../data/raw/"
+
+    table = extract_round_features(raw_data_folder, args.workers)
+    write_round_features(args.output, table)
+    print(str(len(table)) + " rounds written to " + args.output)
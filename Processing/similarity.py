@@ -0,0 +1,271 @@
+import heapq
+import multiprocessing
+import numpy as np
+
+SIMILARITY_CRITERION = ["GoldSetup"]  # events whose counts are compared (the GoldSetup events separate the rounds)
+SIMILARITY_THRESHOLD = 6  # trajectories closer than this to a previous trajectory are not compared with the next ones
+BLOCK_ROWS = 256  # rows of the distance matrix computed at once
+EDIT_BAND = 50  # edit distances greater than this (in states) are not computed: such trajectories are not neighbours
+NEIGHBOURS = 5  # number of nearest neighbours kept for each trajectory
+TILE_SIZE = 64  # trajectories per side of the tiles of the upper triangle scheduled on the pool
+SHINGLE_SIZE = 3  # length of the n-grams of states the trajectories are shingled into
+MINHASH_PERMUTATIONS = 64  # number of hash functions of the minhash signatures
+LSH_BANDS = 16  # bands the signatures are split into: trajectories sharing a band are candidate neighbours
+MINHASH_PRIME = (1 << 31) - 1  # modulus of the hash functions of the minhash signatures
+MINHASH_SEED = 0  # seed of the coefficients of the hash functions
+
+SEQUENCES = []  # state sequences of the trajectories, set in each process of the pool
+
+
+def count_features(sequences, vocabulary_size):
+    """
+    build one vector per trajectory with the number of occurrences of each event of the vocabulary
+    :param sequences: action meanings of the trajectories, as arrays of event codes
+    :param vocabulary_size: number of events of the vocabulary the action meanings are encoded with
+    :return: matrix with a row per trajectory and a column per event
+    """
+    features = np.zeros((len(sequences), vocabulary_size), dtype=np.int32)
+    for i, sequence in enumerate(sequences):
+        features[i] = np.bincount(np.frombuffer(sequence, dtype=np.uint16), minlength=vocabulary_size)
+    return features
+
+
+def count_similarities(features, columns, threshold=SIMILARITY_THRESHOLD, block_rows=BLOCK_ROWS):
+    """
+    compare every trajectory with the following ones by the absolute difference of their counts of the given events,
+    skipping (as source) the trajectories that are closer than the threshold to a previous one;
+    the distances are computed a block of rows at a time, and only the skipping is done row by row
+    :param features: count vectors of the trajectories (see count_features)
+    :param columns: columns of the events whose counts are compared
+    :param threshold: distance under which a trajectory is skipped
+    :param block_rows: rows of the distance matrix computed at once
+    :return: list of the similarities, with the indexes of the source and target trajectories
+    """
+    counts = features[:, columns]
+    skipped = np.zeros(len(counts), dtype=bool)
+    traj_similarity = []
+
+    for start in range(0, len(counts) - 1, block_rows):
+        stop = min(start + block_rows, len(counts) - 1)
+        distances = np.abs(counts[start:stop, np.newaxis, :] - counts[np.newaxis, :, :]).sum(axis=2)
+
+        for i in range(start, stop):
+            if skipped[i]:
+                continue
+            row = distances[i - start, i + 1:]
+            for j, sim in enumerate(row.tolist(), i + 1):
+                traj_similarity.append({'id': str(len(traj_similarity)),
+                                        'source': i,
+                                        'target': j,
+                                        'similarity': sim
+                                        })
+            skipped[i + 1:] |= row < threshold
+    return traj_similarity
+
+
+def banded_edit_distance(a, b, band=EDIT_BAND):
+    """
+    edit distance between two sequences, computed only on the cells of the dynamic programming matrix whose distance
+    from the diagonal is at most the band
+    :param a: first sequence
+    :param b: second sequence
+    :param band: greatest distance computed
+    :return: the edit distance, or None if it is greater than the band
+    """
+    if abs(len(a) - len(b)) > band:
+        return None
+    outside = band + 1  # value of the cells outside the band, greater than any distance within it
+    previous = [j if j <= band else outside for j in range(len(b) + 1)]
+    current = [outside] * (len(b) + 1)
+
+    for i in range(1, len(a) + 1):
+        low = max(1, i - band)
+        high = min(len(b), i + band)
+        # the left border of the band may hold a value of two rows before
+        current[low - 1] = i if low == 1 else outside
+        item = a[i - 1]
+        row_min = current[low - 1]
+        for j in range(low, high + 1):
+            distance = previous[j - 1] + (item != b[j - 1])
+            if current[j - 1] + 1 < distance:
+                distance = current[j - 1] + 1
+            if previous[j] + 1 < distance:
+                distance = previous[j] + 1
+            current[j] = distance
+            if distance < row_min:
+                row_min = distance
+        if row_min > band:
+            return None
+        previous, current = current, previous
+
+    return previous[len(b)] if previous[len(b)] <= band else None
+
+
+def initialize_sequences(sequences):
+    global SEQUENCES
+    SEQUENCES = sequences
+
+
+def edit_distance_tile(arguments):
+    """
+    compute the normalized edit distances of a tile of the upper triangle and keep the nearest neighbours found in it
+    for each of its rows and columns (the nearest neighbours of a trajectory are among those of all its tiles)
+    :param arguments: first and last row and first and last column of the tile, band, number of neighbours
+    :return: dictionary of the nearest neighbours found, as (distance, neighbour) lists indexed by trajectory
+    """
+    row_start, row_stop, column_start, column_stop, band, neighbours = arguments
+    found = {}
+    for i in range(row_start, row_stop):
+        for j in range(max(column_start, i + 1), column_stop):
+            distance = banded_edit_distance(SEQUENCES[i], SEQUENCES[j], band)
+            if distance is not None:
+                distance = float(distance) / max(len(SEQUENCES[i]), len(SEQUENCES[j]), 1)
+                found.setdefault(i, []).append((distance, j))
+                found.setdefault(j, []).append((distance, i))
+    return dict((index, heapq.nsmallest(neighbours, candidates)) for index, candidates in found.items())
+
+
+def edit_similarities(sequences, band=EDIT_BAND, neighbours=NEIGHBOURS, workers=1, tile_size=TILE_SIZE):
+    """
+    find the nearest neighbours of each trajectory by the edit distance of their state sequences, normalized by the
+    length of the longer sequence; the upper triangle of the pairs is split into tiles, computed by a pool of
+    processes if workers > 1
+    :param sequences: state sequences of the trajectories
+    :param band: greatest edit distance computed
+    :param neighbours: number of nearest neighbours kept for each trajectory
+    :param workers: number of processes computing the tiles
+    :param tile_size: trajectories per side of the tiles
+    :return: list of the similarities between each trajectory and its nearest neighbours, each pair listed once
+    """
+    tiles = [(row_start, min(row_start + tile_size, len(sequences)),
+              column_start, min(column_start + tile_size, len(sequences)), band, neighbours)
+             for row_start in range(0, len(sequences), tile_size)
+             for column_start in range(row_start, len(sequences), tile_size)]
+
+    if workers > 1 and len(tiles) > 1:
+        pool = multiprocessing.Pool(workers, initialize_sequences, (sequences,))
+        try:
+            results = pool.imap_unordered(edit_distance_tile, tiles)
+            nearest = merge_neighbours(results, neighbours)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        initialize_sequences(sequences)
+        try:
+            nearest = merge_neighbours((edit_distance_tile(tile) for tile in tiles), neighbours)
+        finally:
+            initialize_sequences([])
+
+    return neighbour_similarities(nearest)
+
+
+def neighbour_similarities(nearest):
+    """
+    :param nearest: dictionary of the nearest neighbours of each trajectory, as (distance, neighbour) lists
+    :return: list of the similarities between each trajectory and its nearest neighbours, each pair listed once
+    """
+    pairs = set()
+    for index, candidates in nearest.items():
+        for distance, neighbour in candidates:
+            pairs.add((min(index, neighbour), max(index, neighbour), distance))
+
+    traj_similarity = []
+    for source, target, distance in sorted(pairs):
+        traj_similarity.append({'id': str(len(traj_similarity)),
+                                'source': source,
+                                'target': target,
+                                'similarity': distance
+                                })
+    return traj_similarity
+
+
+def merge_neighbours(results, neighbours):
+    """
+    :param results: nearest neighbours found in each tile
+    :param neighbours: number of nearest neighbours kept for each trajectory
+    :return: dictionary of the nearest neighbours of each trajectory, as (distance, neighbour) lists
+    """
+    nearest = {}
+    for found in results:
+        for index, candidates in found.items():
+            nearest[index] = heapq.nsmallest(neighbours, nearest.get(index, []) + candidates)
+    return nearest
+
+
+def shingles(sequence, size=SHINGLE_SIZE):
+    """
+    :param sequence: state sequence of a trajectory
+    :param size: length of the n-grams
+    :return: hashes of the n-grams of the sequence (the whole sequence if shorter than an n-gram)
+    """
+    if len(sequence) <= size:
+        return {hash(tuple(sequence)) % MINHASH_PRIME}
+    return set(hash(tuple(sequence[i:i + size])) % MINHASH_PRIME for i in range(len(sequence) - size + 1))
+
+
+def minhash_signatures(sequences, permutations=MINHASH_PERMUTATIONS, shingle_size=SHINGLE_SIZE, seed=MINHASH_SEED):
+    """
+    compute the minhash signature of each trajectory: the minimum of each hash function (a * x + b) mod p over the
+    shingles of the trajectory; two signatures agree on a hash function with probability equal to the jaccard
+    similarity of the shingles
+    :param sequences: state sequences of the trajectories
+    :param permutations: number of hash functions
+    :param shingle_size: length of the n-grams of states
+    :param seed: seed of the coefficients of the hash functions
+    :return: matrix with a row per trajectory and a column per hash function
+    """
+    random_state = np.random.RandomState(seed)
+    a = random_state.randint(1, MINHASH_PRIME, size=permutations).astype(np.uint64)
+    b = random_state.randint(0, MINHASH_PRIME, size=permutations).astype(np.uint64)
+
+    signatures = np.empty((len(sequences), permutations), dtype=np.uint64)
+    for i, sequence in enumerate(sequences):
+        hashes = np.fromiter(shingles(sequence, shingle_size), dtype=np.uint64)
+        signatures[i] = ((a[:, np.newaxis] * hashes[np.newaxis, :] + b[:, np.newaxis]) % MINHASH_PRIME).min(axis=1)
+    return signatures
+
+
+def lsh_candidates(signatures, bands=LSH_BANDS):
+    """
+    index the signatures by band: trajectories whose signatures are equal on at least one band are candidates
+    :param signatures: minhash signatures of the trajectories
+    :param bands: number of bands the signatures are split into
+    :return: set of the candidate pairs (i, j), with i < j
+    """
+    rows = signatures.shape[1] // bands
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for i, key in enumerate(signatures[:, band * rows:(band + 1) * rows]):
+            buckets.setdefault(key.tostring(), []).append(i)
+        for bucket in buckets.values():
+            for position, i in enumerate(bucket):
+                for j in bucket[position + 1:]:
+                    candidates.add((i, j))
+    return candidates
+
+
+def minhash_similarities(sequences, band=EDIT_BAND, neighbours=NEIGHBOURS, permutations=MINHASH_PERMUTATIONS,
+                         bands=LSH_BANDS, shingle_size=SHINGLE_SIZE):
+    """
+    approximate edit_similarities: only the candidate pairs found by the lsh index of the minhash signatures of the
+    trajectories are scored with the edit distance
+    :param sequences: state sequences of the trajectories
+    :param band: greatest edit distance computed
+    :param neighbours: number of nearest neighbours kept for each trajectory
+    :param permutations: number of hash functions of the minhash signatures
+    :param bands: number of bands of the lsh index
+    :param shingle_size: length of the n-grams of states
+    :return: list of the similarities between each trajectory and its nearest neighbours, each pair listed once
+    """
+    signatures = minhash_signatures(sequences, permutations, shingle_size)
+    found = {}
+    for i, j in lsh_candidates(signatures, bands):
+        distance = banded_edit_distance(sequences[i], sequences[j], band)
+        if distance is not None:
+            distance = float(distance) / max(len(sequences[i]), len(sequences[j]), 1)
+            found.setdefault(i, []).append((distance, j))
+            found.setdefault(j, []).append((distance, i))
+    return neighbour_similarities(dict((index, heapq.nsmallest(neighbours, candidates))
+                                       for index, candidates in found.items()))
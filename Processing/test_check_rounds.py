@@ -0,0 +1,75 @@
+import os
+import csv
+import shutil
+import tempfile
+import unittest
+
+import check_rounds
+
+# log of a team with 2 rounds; the chat message spans two lines (see CheckRoundsTest.write_fixture), so the file
+# is quoted and parsed with the csv reader
+FIXTURE_ROWS = [
+    ["SetupMatch", "0", "", "", "", "2"],
+    ["ChatMessage", "0", "p1", "hello", "all"],
+    ["GoldSetup", "0"],
+    ["Vote", "0", "p1", "Pickaxe"],
+    ["GoldSetup", "0"],
+    ["TotalGold", "0", "100"],
+    ["GameSuspended", "0"],
+    ["TotalGold", "0", "999"]
+]
+
+
+class CheckRoundsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_fixture(self, name, rows, line_end):
+        """
+        :param name: name of the fixture file
+        :param rows: rows of the file; the last cells of the chat messages are joined by the line end of the file
+        :param line_end: line end of the file
+        :return: path of the file
+        """
+        rows = [row[:3] + [line_end.join(row[3:])] if row[0] == "ChatMessage" else row for row in rows]
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as data_file:
+            csv.writer(data_file, lineterminator=line_end).writerows(rows)
+        return path
+
+    def check_markers(self, rows, line_end):
+        path = self.write_fixture("team.csv", rows, line_end)
+        markers = check_rounds.scan_markers(path)
+        self.assertEqual([row_number for offset, row_number in markers["GoldSetup"]], [2, 4])
+        self.assertEqual([row_number for offset, row_number in markers["GameSuspended"]], [6])
+        # reading from the offset of a marker gives the rows from that marker
+        offset = markers["GoldSetup"][1][0]
+        stop = check_rounds.truncation_point(markers)[0]
+        self.assertEqual(list(check_rounds.read_rows_at(path, offset, stop)), rows[4:6])
+        self.assertEqual(list(check_rounds.read_rows_at(path, stop)), rows[6:])
+
+    def test_quoted_file(self):
+        for line_end in ["\n", "\r\n", "\r"]:
+            self.check_markers(FIXTURE_ROWS, line_end)
+
+    def test_unquoted_file(self):
+        rows = [row for row in FIXTURE_ROWS if row[0] != "ChatMessage"]
+        path = self.write_fixture("team.csv", rows, "\r")
+        markers = check_rounds.scan_markers(path)
+        self.assertEqual([row_number for offset, row_number in markers["GoldSetup"]], [1, 3])
+        self.assertEqual(list(check_rounds.read_rows_at(path, markers["GoldSetup"][0][0])), rows[1:])
+
+    def test_line_offsets(self):
+        # a \r\n split across the chunks read by LineOffsets is a single newline
+        path = self.write_fixture("team.csv", [["a" * (check_rounds.LINE_CHUNK - 1)], ["b"]], "\r\n")
+        with open(path, 'rb') as data_file:
+            lines = check_rounds.LineOffsets(data_file)
+            self.assertEqual([len(line) for line in lines], [check_rounds.LINE_CHUNK, 2])
+            self.assertEqual(lines.offset, os.path.getsize(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
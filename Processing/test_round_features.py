@@ -0,0 +1,123 @@
+import os
+import csv
+import math
+import shutil
+import tempfile
+import unittest
+
+import data_parsing_gallup as gallup
+import round_features
+
+try:
+    import event_cache  # needs numpy
+except ImportError:
+    event_cache = None
+
+TEAM_FILE = "team_fixture.csv"  # name of the fixture log
+# log of a team with 3 rounds; the chat message of the setup and the rows after GameSuspended belong to no round
+FIXTURE_ROWS = [
+    ["PlayerConnection", "0", "p1"],
+    ["PlayerConnection", "0", "p2"],
+    ["SetupMatch", "0", "", "", "", "2"],
+    ["ItemSetup", "0", "Pickaxe", "", "0.9"],
+    ["ItemSetup", "0", "Dynamite", "", "0.3"],
+    ["MineSetup", "0", "GoldMine", "", "(0.1 0.5)"],
+    ["ChatMessage", "0", "p1", "hello"],
+    # round 1: votes 0.9 and 0.3, the leader selects the safer item (low risk)
+    ["GoldSetup", "0"],
+    ["StartVotation", "0", "Pickaxe", "Dynamite"],
+    ["Vote", "0", "p1", "Pickaxe"],
+    ["Vote", "0", "p2", "Dynamite"],
+    ["LeaderSelection", "0", "Pickaxe"],
+    ["ChatMessage", "0", "p2", "hi"],
+    ["TotalGold", "0", "100"],
+    # round 2: nothing happens, the gold of the team is the same
+    ["GoldSetup", "0"],
+    # round 3: a new leader selects the mine (high risk); the vote on the mine is not a tool vote (see handle_vote)
+    ["GoldSetup", "0"],
+    ["NewLeader", "0", "p2"],
+    ["StartVotation", "0", "GoldMine", "Dynamite"],
+    ["Vote", "0", "p1", "GoldMine"],
+    ["Vote", "0", "p2", "Dynamite"],
+    ["LeaderSelection", "0", "GoldMine"],
+    ["CensoredMessage", "0", "p1", "***"],
+    ["TotalGold", "0", "250"],
+    ["GameSuspended", "0"],
+    ["ChatMessage", "0", "p1", "late"],
+    ["TotalGold", "0", "999"]
+]
+
+
+class RoundFeaturesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.input_folder = os.path.join(self.folder, "raw") + os.sep
+        os.mkdir(self.input_folder)
+        with open(self.input_folder + TEAM_FILE, 'wb') as data_file:
+            csv.writer(data_file).writerows(FIXTURE_ROWS)
+
+    def tearDown(self):
+        gallup.EVENT_CACHE_FOLDER = None
+        shutil.rmtree(self.folder)
+
+    def features(self, row, column):
+        return row[len(round_features.KEY_COLUMNS) + round_features.FEATURE_COLUMNS.index(column)]
+
+    def check_table(self, table):
+        self.assertEqual([row[:2] for row in table], [[TEAM_FILE, "Competition2"]] * 3)
+        self.assertEqual([self.features(row, "round") for row in table], [1, 2, 3])
+        self.assertEqual([self.features(row, "total_gold") for row in table], [100, 100, 250])
+
+        first = table[0]
+        self.assertEqual(self.features(first, "tool_votes"), 2)
+        self.assertAlmostEqual(self.features(first, "voting_st_dev"), math.sqrt(0.18))
+        self.assertEqual([self.features(first, "risk_" + label) for label in round_features.RISK_LABELS],
+                         [0, 0, 1, 0])
+        self.assertEqual(self.features(first, "selections"), 1)
+        self.assertAlmostEqual(self.features(first, "mean_selected_prob"), 0.9)
+        self.assertEqual([self.features(first, column) for column in
+                          ["leader_changes", "chat_messages", "censored_messages"]], [0, 1, 0])
+
+        self.assertEqual(self.features(table[1], "tool_votes"), 0)
+        self.assertTrue(math.isnan(self.features(table[1], "mean_selected_prob")))
+
+        last = table[-1]
+        self.assertEqual(self.features(last, "tool_votes"), 1)
+        self.assertTrue(math.isnan(self.features(last, "voting_st_dev")))
+        self.assertEqual([self.features(last, "risk_" + label) for label in round_features.RISK_LABELS],
+                         [0, 0, 0, 1])
+        self.assertEqual(self.features(last, "selections"), 1)
+        self.assertAlmostEqual(self.features(last, "mean_selected_prob"), 0.1)
+        self.assertEqual([self.features(last, column) for column in
+                          ["leader_changes", "chat_messages", "censored_messages"]], [1, 0, 1])
+
+    def test_rounds(self):
+        self.check_table(round_features.extract_round_features(self.input_folder))
+
+    def test_rounds_from_event_cache(self):
+        if event_cache is None:
+            self.skipTest("the event cache needs numpy")
+        gallup.EVENT_CACHE_FOLDER = os.path.join(self.folder, "event_cache") + os.sep
+        self.check_table(round_features.extract_round_features(self.input_folder))
+
+    def test_round_window_is_ignored(self):
+        gallup.ROUND_WINDOW = (2, 2)
+        try:
+            self.check_table(round_features.extract_round_features(self.input_folder))
+        finally:
+            gallup.ROUND_WINDOW = None
+
+    def test_write_csv(self):
+        path = os.path.join(self.folder, "round_features.csv")
+        round_features.write_csv(path, round_features.extract_round_features(self.input_folder))
+        with open(path, 'rU') as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows[0], round_features.KEY_COLUMNS + round_features.FEATURE_COLUMNS)
+        self.assertEqual(len(rows), 4)
+        # the undefined st_dev of the last round is left empty
+        self.assertEqual(rows[-1][len(round_features.KEY_COLUMNS) +
+                                  round_features.FEATURE_COLUMNS.index("voting_st_dev")], "")
+
+
+if __name__ == "__main__":
+    unittest.main()